@@ -6,9 +6,19 @@ from zoneinfo import ZoneInfo
 CT = ZoneInfo("America/Chicago")
 
 class CTFormatter(logging.Formatter):
+    # (epoch second, formatted) -- the format has no sub-second field, so every
+    # record within the same second renders identically.
+    _second_cache = (-1, "")
+
     def formatTime(self, record, datefmt=None):
-        dt = datetime.fromtimestamp(record.created, tz=CT)
-        return dt.strftime(datefmt or "%m/%d/%Y %I:%M:%S %p")
+        if datefmt:
+            return datetime.fromtimestamp(record.created, tz=CT).strftime(datefmt)
+        t = int(record.created)
+        cached_t, text = self._second_cache
+        if cached_t != t:
+            text = datetime.fromtimestamp(t, tz=CT).strftime("%m/%d/%Y %I:%M:%S %p")
+            self._second_cache = (t, text)
+        return text
 
 def build_logger(name: str = "engine") -> logging.Logger:
     logger = logging.getLogger(name)
@@ -6,7 +6,27 @@ import hashlib
 from typing import Any, Dict, Optional
 
 import psycopg2
-from psycopg2.extras import Json
+
+# Optional fast JSON for state persistence (stdlib json is the fallback)
+try:
+    import orjson
+
+    HAS_ORJSON = True
+except Exception:
+    orjson = None
+    HAS_ORJSON = False
+
+
+def state_dumps(state: Dict[str, Any]) -> bytes:
+    if HAS_ORJSON:
+        return orjson.dumps(state, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(state, separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+
+def state_loads(buf: bytes) -> Dict[str, Any]:
+    if HAS_ORJSON:
+        return orjson.loads(buf)
+    return json.loads(buf)
 
 
 # ----------------------------
@@ -103,11 +123,11 @@ def save_state_db(conn, state_id: str, state: Dict[str, Any]) -> None:
         cur.execute(
             """
             INSERT INTO engine_state (id, state, updated_at)
-            VALUES (%s, %s, now())
+            VALUES (%s, %s::jsonb, now())
             ON CONFLICT (id)
             DO UPDATE SET state = EXCLUDED.state, updated_at = now();
             """,
-            (state_id, Json(state)),
+            (state_id, state_dumps(state).decode("utf-8")),
         )
 
 
@@ -117,20 +137,34 @@ def save_state_db(conn, state_id: str, state: Dict[str, Any]) -> None:
 def load_state_disk(state_path: str) -> Dict[str, Any]:
     try:
         if state_path and os.path.exists(state_path):
-            with open(state_path, "r", encoding="utf-8") as f:
-                return json.load(f) or {}
+            with open(state_path, "rb") as f:
+                return state_loads(f.read()) or {}
     except Exception:
         pass
     return {}
 
 
+# Last bytes written per path; the engine saves every tick, mostly unchanged
+_last_disk_body: Dict[str, bytes] = {}
+
+
 def save_state_disk(state_path: str, state: Dict[str, Any]) -> None:
     try:
         if not state_path:
             return
+        body = state_dumps(state)
+        if _last_disk_body.get(state_path) == body:
+            return
         os.makedirs(os.path.dirname(state_path), exist_ok=True)
-        with open(state_path, "w", encoding="utf-8") as f:
-            json.dump(state, f, indent=2, sort_keys=True)
+
+        # Write a temp file, fsync, then atomic rename: a crash never leaves a torn state file
+        tmp = state_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, state_path)
+        _last_disk_body[state_path] = body
     except Exception:
         pass
 
@@ -2,19 +2,48 @@ import os
 import time
 import json
 import logging
+import logging.handlers
 import hashlib
+import math
 import random
 import re
+import atexit
+import queue
+import signal
+import socket
+import sys
+import threading
+import uuid
+import weakref
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timezone, timedelta
+from functools import lru_cache
 from zoneinfo import ZoneInfo
-from typing import Callable, TypeVar, Optional, Tuple
+from typing import Callable, TypeVar, Optional, Tuple, NamedTuple
 
 import alpaca_trade_api as tradeapi
 from alpaca_trade_api.rest import TimeFrame
+from alpaca_trade_api.entity import Order
+from alpaca_trade_api.stream import Stream
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout as RequestsTimeout
+from urllib3.connection import HTTPConnection
 
 # Postgres (for resilient v1 state + leader lock)
 import psycopg2
-from psycopg2.extras import Json
+from psycopg2.extensions import QueryCanceledError
+
+# Optional fast JSON for state persistence (stdlib json is the fallback)
+try:
+    import orjson
+
+    HAS_ORJSON = True
+except Exception:
+    orjson = None
+    HAS_ORJSON = False
 
 
 # =========================
@@ -25,76 +54,285 @@ ET = ZoneInfo("America/New_York")
 
 
 class CTFormatter(logging.Formatter):
+    # (epoch minute, "YYYY-mm-dd HH:MM") -- CT offsets are whole hours, so CT
+    # minutes line up with epoch minutes and only the seconds change per record.
+    _minute_cache: Tuple[int, str] = (-1, "")
+
     def formatTime(self, record, datefmt=None):
-        dt = datetime.fromtimestamp(record.created, tz=CT)
-        return dt.strftime(datefmt or "%Y-%m-%d %H:%M:%S")
+        if datefmt:
+            return datetime.fromtimestamp(record.created, tz=CT).strftime(datefmt)
+        t = int(record.created)
+        minute, sec = divmod(t, 60)
+        cached_minute, prefix = self._minute_cache
+        if cached_minute != minute:
+            prefix = datetime.fromtimestamp(t, tz=CT).strftime("%Y-%m-%d %H:%M")
+            self._minute_cache = (minute, prefix)
+        return f"{prefix}:{sec:02d}"
+
+
+# Bounded so a stalled stderr can't grow memory without limit; past this, records are dropped
+LOG_QUEUE_MAX = 10000
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the caller: a full queue drops the record and counts it."""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
 
 
 logger = logging.getLogger("engine")
 logger.setLevel(logging.INFO)
 handler = logging.StreamHandler()
 handler.setFormatter(CTFormatter(fmt="%(asctime)s CT [%(levelname)s] %(message)s"))
-logger.handlers = [handler]
+
+# QueueHandler.prepare still formats each record on the calling thread (args and
+# exc_info are resolved before it crosses threads); only the stream write and flush
+# move to the listener thread.
+_log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=LOG_QUEUE_MAX)
+_log_queue_handler = DroppingQueueHandler(_log_queue)
+_log_listener = logging.handlers.QueueListener(_log_queue, handler, respect_handler_level=True)
+logger.handlers = [_log_queue_handler]
 logger.propagate = False
+_log_listener.start()
+
+
+def _stop_log_listener():
+    # Flushes whatever is still queued; registered first so it runs after every other atexit hook
+    _log_listener.stop()
+    if _log_queue_handler.dropped:
+        handler.handle(
+            logger.makeRecord(
+                logger.name, logging.WARNING, __file__, 0,
+                "LOG_DROPPED records=%d (log queue full)", (_log_queue_handler.dropped,), None,
+            )
+        )
+
+
+atexit.register(_stop_log_listener)
+
+# Bound once for the retry paths, which can log on every attempt during an outage
+_warn, _error = logger.warning, logger.error
+
+# A repeating loop error would otherwise format a full traceback every poll;
+# only the first per (tag, exception type) in this window gets one.
+TRACEBACK_EVERY_SEC = 30.0
+_last_traceback_mono: dict = {}
+
+
+def want_traceback(tag: str, e: BaseException) -> bool:
+    key = (tag, type(e).__name__)
+    now = time.monotonic()
+    last = _last_traceback_mono.get(key)
+    if last is not None and (now - last) < TRACEBACK_EVERY_SEC:
+        return False
+    _last_traceback_mono[key] = now
+    return True
+
+
+class PosnChangeFilter(logging.Filter):
+    """Drops records tagged extra={"posn_change": True}; installed when LOG_POSITION_CHANGES is off."""
+
+    def filter(self, record):
+        return not getattr(record, "posn_change", False)
 
 
 # =========================
 # Banners / Heartbeat
 # =========================
 HEARTBEAT_SEC = 300  # 5 minutes
-_last_heartbeat_ts = 0
+_next_heartbeat_mono = 0.0
+
+# Each banner is one %-style template and one logger call: one record, one
+# lock acquisition and one handler write per banner instead of one per row.
+_STARTUP_TMPL = (
+    "\n"
+    "==============================================\n"
+    "🚀 BOT STARTUP CONFIRMATION BANNER\n"
+    "----------------------------------------------\n"
+    "MODE:               %s\n"
+    "SYMBOL:             %s\n"
+    "SELL_RISE_USD:      %.2f\n"
+    "GRID_STEP_START:    %.2f\n"
+    "GRID_TIER_SIZE:     %s\n"
+    "GRID_STEP_INC:      %.2f\n"
+    "LEADER:             %s\n"
+    "ORDERS:             %s\n"
+    "DRY_RUN:            %s\n"
+    "KILL_SWITCH:        %s\n"
+    "ENDPOINT:           %s\n"
+    "DATA_FEED:          %s\n"
+    "==============================================\n"
+)
+
+_HEARTBEAT_TMPL = (
+    "\n"
+    "💓 HEARTBEAT\n"
+    "----------------------------------------------\n"
+    "MODE:       %s\n"
+    "SYMBOL:     %s\n"
+    "POS_QTY:    %d\n"
+    "AVG_ENTRY:  %s\n"
+    "SELL_RISE:  $%.2f\n"
+    "SELL_TGT:   %s\n"
+    "LEADER:     %s\n"
+    "KILL_SW:    %s\n"
+    "----------------------------------------------\n"
+)
+
+_PROFIT_TMPL = (
+    "\n"
+    "📊 LIVE PROFIT TRACKER (unrealized)\n"
+    "------------------------------------------------\n"
+    "SYMBOL:      %s\n"
+    "LEADER:      %s\n"
+    "POS_QTY:     %d\n"
+    "AVG_ENTRY:   %s\n"
+    "LAST_PRICE:  %s\n"
+    "MKT_VALUE:   %s\n"
+    "UNRLZD_P/L:  %s\n"
+    "UNRLZD_%%:    %s\n"
+    "SELL_RISE:   $%.2f\n"
+    "SELL_TGT:    %s\n"
+    "------------------------------------------------\n"
+)
+
+_DAILY_SUMMARY_TMPL = (
+    "\n"
+    "📅 DAILY SUMMARY (Market Close)\n"
+    "------------------------------------------------\n"
+    "DATE_ET:       %s\n"
+    "MODE:          %s\n"
+    "SYMBOL:        %s\n"
+    "LEADER:        %s\n"
+    "POS_QTY:       %d\n"
+    "OWNED_QTY:     %d\n"
+    "AVG_ENTRY:     %s\n"
+    "SELL_RISE_USD: $%.2f\n"
+    "SELL_TARGET:   %s\n"
+    "BUYS_TODAY_ET: %d\n"
+    "BUY_COUNT_TTL: %d\n"
+    "GROUP_BUY_CNT: %d\n"
+    "UNRLZD_P/L:    %s\n"
+    "UNRLZD_%%:      %s\n"
+    "MKT_VALUE:     %s\n"
+    "------------------------------------------------\n"
+)
+
+# SELL_TGT is optional here, so the row list is joined before logging
+_FIRST_BUY_HEAD = (
+    "✅ FIRST BUY CONFIRMED (GRID GROUP START)\n"
+    "----------------------------------------------\n"
+    "MODE:      %s\n"
+    "ORDERS:    %s\n"
+    "SYMBOL:    %s\n"
+    "ANCHOR:    %.2f\n"
+    "BUY_QTY:   %s\n"
+    "SELL_RISE: $%.2f"
+)
+_FIRST_BUY_TAIL = (
+    "LEADER:    %s\n"
+    "KILL_SW:   %s\n"
+    "----------------------------------------------"
+)
+
+_SELL_ARMING_TMPL = (
+    "⚠️  SELL ARMING (approaching target)\n"
+    "------------------------------------------------\n"
+    "SYMBOL:    %s\n"
+    "CLOSE:     %.2f\n"
+    "TARGET:    %.2f\n"
+    "ARM_AT:    %.2f\n"
+    "LEADER:    %s\n"
+    "DRY_RUN:   %s\n"
+    "------------------------------------------------"
+)
+
+_SELL_TMPL = (
+    "✅ SELL CONFIRMED (GRID GROUP EXIT)\n"
+    "----------------------------------------------\n"
+    "SYMBOL:      %s\n"
+    "SELL_QTY:    %s\n"
+    "CLOSE:       %.2f\n"
+    "POS_BEFORE:  %.4f\n"
+    "ANCHOR:      %s\n"
+    "SELL_TGT:    %s\n"
+    "LEADER:      %s\n"
+    "DRY_RUN:     %s\n"
+    "----------------------------------------------"
+)
+
+_SNAPSHOT_TMPL = "📌 SNAPSHOT %s | H:%s L:%s | VWAP:%s | P/L:%s (%s) | QTY:%d | LEADER:%s"
+
+
+# Banner field formatters: optional values render as "None"
+def _fmt2(x) -> str:
+    return "None" if x is None else f"{float(x):.2f}"
+
+
+def _fmt_money(x) -> str:
+    return "None" if x is None else f"${float(x):,.2f}"
+
+
+def _fmt_pct(x) -> str:
+    return "None" if x is None else f"{float(x) * 100.0:.3f}%"
 
 
 def print_startup_banner(*, live_endpoint: bool, is_leader: bool):
+    if not logger.isEnabledFor(logging.WARNING):
+        return
+
     mode = "SIMULATION (DRY_RUN)" if DRY_RUN else ("LIVE PAPER" if not live_endpoint else "LIVE REAL MONEY")
     orders = "ENABLED" if (is_leader and not KILL_SWITCH) else "BLOCKED"
 
-    logger.warning("")
-    logger.warning("==============================================")
-    logger.warning("🚀 BOT STARTUP CONFIRMATION BANNER")
-    logger.warning("----------------------------------------------")
-    logger.warning(f"MODE:               {mode}")
-    logger.warning(f"SYMBOL:             {SYMBOL}")
-    logger.warning(f"SELL_RISE_USD:      {SELL_RISE_USD:.2f}")
-    logger.warning(f"GRID_STEP_START:    {GRID_STEP_START_USD:.2f}")
-    logger.warning(f"GRID_TIER_SIZE:     {GRID_TIER_SIZE}")
-    logger.warning(f"GRID_STEP_INC:      {GRID_STEP_INC_USD:.2f}")
-    logger.warning(f"LEADER:             {is_leader}")
-    logger.warning(f"ORDERS:             {orders}")
-    logger.warning(f"DRY_RUN:            {DRY_RUN}")
-    logger.warning(f"KILL_SWITCH:        {KILL_SWITCH}")
-    logger.warning(f"ENDPOINT:           {ALPACA_BASE_URL}")
-    logger.warning(f"DATA_FEED:          {ALPACA_DATA_FEED}")
-    logger.warning("==============================================")
-    logger.warning("")
+    logger.warning(
+        _STARTUP_TMPL,
+        mode,
+        SYMBOL,
+        SELL_RISE_USD,
+        GRID_STEP_START_USD,
+        GRID_TIER_SIZE,
+        GRID_STEP_INC_USD,
+        is_leader,
+        orders,
+        DRY_RUN,
+        KILL_SWITCH,
+        ALPACA_BASE_URL,
+        ALPACA_DATA_FEED,
+    )
 
 
 def maybe_print_heartbeat(*, pos_qty, avg_entry, sell_target, is_leader):
-    global _last_heartbeat_ts
+    global _next_heartbeat_mono
+
+    if not logger.isEnabledFor(BANNER_LOG_LEVEL):
+        return
 
-    now = time.time()
-    if now - _last_heartbeat_ts < HEARTBEAT_SEC:
+    now = time.monotonic()
+    if now < _next_heartbeat_mono:
         return
 
-    _last_heartbeat_ts = now
+    _next_heartbeat_mono = now + HEARTBEAT_SEC
 
     mode = "SIM" if DRY_RUN else "LIVE"
-    target_str = f"{sell_target:.2f}" if sell_target is not None else "None"
-    avg_str = f"{avg_entry:.2f}" if avg_entry is not None else "None"
-
-    logger.warning("")
-    logger.warning("💓 HEARTBEAT")
-    logger.warning("----------------------------------------------")
-    logger.warning(f"MODE:       {mode}")
-    logger.warning(f"SYMBOL:     {SYMBOL}")
-    logger.warning(f"POS_QTY:    {int(pos_qty)}")
-    logger.warning(f"AVG_ENTRY:  {avg_str}")
-    logger.warning(f"SELL_RISE:  ${SELL_RISE_USD:.2f}")
-    logger.warning(f"SELL_TGT:   {target_str}")
-    logger.warning(f"LEADER:     {is_leader}")
-    logger.warning(f"KILL_SW:    {KILL_SWITCH}")
-    logger.warning("----------------------------------------------")
-    logger.warning("")
+
+    logger.log(
+        BANNER_LOG_LEVEL,
+        _HEARTBEAT_TMPL,
+        mode,
+        SYMBOL,
+        int(pos_qty),
+        _fmt2(avg_entry),
+        SELL_RISE_USD,
+        _fmt2(sell_target),
+        is_leader,
+        KILL_SWITCH,
+    )
 
 
 def print_profit_tracker_banner(
@@ -110,23 +348,23 @@ def print_profit_tracker_banner(
     sell_target: Optional[float],
     is_leader: bool,
 ):
-    logger.warning("")
-    logger.warning("📊 LIVE PROFIT TRACKER (unrealized)")
-    logger.warning("------------------------------------------------")
-    logger.warning(f"SYMBOL:      {symbol}")
-    logger.warning(f"LEADER:      {is_leader}")
-    logger.warning(f"POS_QTY:     {int(float(pos_qty)) if pos_qty is not None else 0}")
-
-    logger.warning(f"AVG_ENTRY:   {float(avg_entry):.2f}" if avg_entry is not None else "AVG_ENTRY:   None")
-    logger.warning(f"LAST_PRICE:  {float(current_price):.2f}" if current_price is not None else "LAST_PRICE:  None")
-    logger.warning(f"MKT_VALUE:   ${float(market_value):,.2f}" if market_value is not None else "MKT_VALUE:   None")
-    logger.warning(f"UNRLZD_P/L:  ${float(unrealized_pl):,.2f}" if unrealized_pl is not None else "UNRLZD_P/L:  None")
-    logger.warning(f"UNRLZD_%:    {float(unrealized_plpc) * 100.0:.3f}%" if unrealized_plpc is not None else "UNRLZD_%:    None")
+    if not logger.isEnabledFor(BANNER_LOG_LEVEL):
+        return
 
-    logger.warning(f"SELL_RISE:   ${float(sell_rise_usd):.2f}")
-    logger.warning(f"SELL_TGT:    {float(sell_target):.2f}" if sell_target is not None else "SELL_TGT:    None")
-    logger.warning("------------------------------------------------")
-    logger.warning("")
+    logger.log(
+        BANNER_LOG_LEVEL,
+        _PROFIT_TMPL,
+        symbol,
+        is_leader,
+        int(float(pos_qty)) if pos_qty is not None else 0,
+        _fmt2(avg_entry),
+        _fmt2(current_price),
+        _fmt_money(market_value),
+        _fmt_money(unrealized_pl),
+        _fmt_pct(unrealized_plpc),
+        float(sell_rise_usd),
+        _fmt2(sell_target),
+    )
 
 
 def print_session_snapshot_line(
@@ -140,6 +378,9 @@ def print_session_snapshot_line(
     pos_qty: float,
     is_leader: bool,
 ):
+    if not logger.isEnabledFor(logging.WARNING):
+        return
+
     hi = f"{session_high:.2f}" if session_high is not None else "—"
     lo = f"{session_low:.2f}" if session_low is not None else "—"
 
@@ -155,14 +396,7 @@ def print_session_snapshot_line(
         pl_str = f"${unrealized_pl:,.2f}" if unrealized_pl is not None else "—"
         plpc_str = f"{unrealized_plpc * 100.0:+.2f}%" if unrealized_plpc is not None else "—"
 
-    logger.warning(
-        f"📌 SNAPSHOT {symbol} | "
-        f"H:{hi} L:{lo} | "
-        f"VWAP:{vwap_str} | "
-        f"P/L:{pl_str} ({plpc_str}) | "
-        f"QTY:{int(pos_qty)} | "
-        f"LEADER:{is_leader}"
-    )
+    logger.warning(_SNAPSHOT_TMPL, symbol, hi, lo, vwap_str, pl_str, plpc_str, int(pos_qty), is_leader)
 
 
 def compute_session_stats_1m(symbol: str, now_utc: datetime):
@@ -230,7 +464,7 @@ def compute_session_stats_1m(symbol: str, now_utc: datetime):
 def maybe_print_session_snapshot(
     *,
     state: dict,
-    now_ts: float,
+    now_mono: float,
     now_utc: datetime,
     symbol: str,
     pos_qty: float,
@@ -239,18 +473,20 @@ def maybe_print_session_snapshot(
     unrealized_plpc: Optional[float],
     is_leader: bool,
 ):
-    if not SESSION_SNAPSHOT_BANNER:
+    # Silenced: skip the 1-min bars fetch too, not just the formatting
+    if not SESSION_SNAPSHOT_BANNER or not logger.isEnabledFor(logging.WARNING):
         return
 
     every = float(SESSION_SNAPSHOT_EVERY_SEC)
     if every <= 0:
         return
 
-    last_ts = float(state.get("last_session_snapshot_ts", 0.0))
-    if (now_ts - last_ts) < every:
+    # Monotonic and in-process only (underscore key): a restart prints right away
+    last = state.get("_last_session_snapshot_mono")
+    if last is not None and (now_mono - last) < every:
         return
 
-    state["last_session_snapshot_ts"] = now_ts
+    state["_last_session_snapshot_mono"] = now_mono
 
     session_high, session_low, vwap, _ = compute_session_stats_1m(symbol, now_utc)
 
@@ -273,7 +509,7 @@ def maybe_print_session_snapshot(
 def maybe_print_profit_tracker_banner(
     *,
     state: dict,
-    now_ts: float,
+    now_mono: float,
     symbol: str,
     pos_qty: float,
     avg_entry: Optional[float],
@@ -285,18 +521,18 @@ def maybe_print_profit_tracker_banner(
     sell_target: Optional[float],
     is_leader: bool,
 ):
-    if DRY_RUN:
+    if DRY_RUN or not logger.isEnabledFor(BANNER_LOG_LEVEL):
         return
 
     every = float(PROFIT_TRACKER_EVERY_SEC)
     if every <= 0:
         return
 
-    last_ts = float(state.get("last_profit_banner_ts", 0.0))
-    if (now_ts - last_ts) < every:
+    last = state.get("_last_profit_banner_mono")
+    if last is not None and (now_mono - last) < every:
         return
 
-    state["last_profit_banner_ts"] = now_ts
+    state["_last_profit_banner_mono"] = now_mono
 
     print_profit_tracker_banner(
         symbol=symbol,
@@ -330,41 +566,55 @@ def print_daily_summary_banner(
     unrealized_plpc: Optional[float],
     market_value: Optional[float],
 ):
+    if not logger.isEnabledFor(BANNER_LOG_LEVEL):
+        return
+
     mode = "SIMULATION (DRY_RUN)" if dry_run else "LIVE (Paper/Live)"
+    live = not dry_run
+
+    logger.log(
+        BANNER_LOG_LEVEL,
+        _DAILY_SUMMARY_TMPL,
+        date_et,
+        mode,
+        symbol,
+        is_leader,
+        int(pos_qty),
+        int(owned_qty),
+        _fmt2(avg_entry),
+        float(sell_rise_usd),
+        _fmt2(sell_target),
+        int(buys_today_et),
+        int(buy_count_total),
+        int(group_buy_count),
+        # P/L fields are only meaningful for real positions
+        _fmt_money(unrealized_pl if live else None),
+        _fmt_pct(unrealized_plpc if live else None),
+        _fmt_money(market_value if live else None),
+    )
 
-    logger.warning("")
-    logger.warning("📅 DAILY SUMMARY (Market Close)")
-    logger.warning("------------------------------------------------")
-    logger.warning(f"DATE_ET:       {date_et}")
-    logger.warning(f"MODE:          {mode}")
-    logger.warning(f"SYMBOL:        {symbol}")
-    logger.warning(f"LEADER:        {is_leader}")
-    logger.warning(f"POS_QTY:       {int(pos_qty)}")
-    logger.warning(f"OWNED_QTY:     {int(owned_qty)}")
-    logger.warning(f"AVG_ENTRY:     {float(avg_entry):.2f}" if avg_entry is not None else "AVG_ENTRY:     None")
-    logger.warning(f"SELL_RISE_USD: ${float(sell_rise_usd):.2f}")
-    logger.warning(f"SELL_TARGET:   {float(sell_target):.2f}" if sell_target is not None else "SELL_TARGET:   None")
-    logger.warning(f"BUYS_TODAY_ET: {int(buys_today_et)}")
-    logger.warning(f"BUY_COUNT_TTL: {int(buy_count_total)}")
-    logger.warning(f"GROUP_BUY_CNT: {int(group_buy_count)}")
-
-    if (not dry_run) and (unrealized_pl is not None):
-        logger.warning(f"UNRLZD_P/L:    ${float(unrealized_pl):,.2f}")
-    else:
-        logger.warning("UNRLZD_P/L:    None")
 
-    if (not dry_run) and (unrealized_plpc is not None):
-        logger.warning(f"UNRLZD_%:      {float(unrealized_plpc) * 100.0:.3f}%")
-    else:
-        logger.warning("UNRLZD_%:      None")
+def daily_summary_due(state: dict, now_utc: datetime) -> Optional[str]:
+    """
+    Returns the ET date string when the daily summary should print now, else None.
+    Cheap enough to call every tick; callers use it to avoid fetching a position
+    snapshot that the banner would not use.
+    """
+    target_minutes = _DAILY_SUMMARY_M
+    if not DAILY_SUMMARY_BANNER or target_minutes is None or not logger.isEnabledFor(BANNER_LOG_LEVEL):
+        return None
 
-    if (not dry_run) and (market_value is not None):
-        logger.warning(f"MKT_VALUE:     ${float(market_value):,.2f}")
-    else:
-        logger.warning("MKT_VALUE:     None")
+    # Window first: outside those 6 minutes a day this is one cached lookup.
+    # Both ET lookups reuse the per-minute caches the trade window and rollover use.
+    now_minutes = _et_minute_of_day(now_utc.replace(second=0, microsecond=0))
+    if not (target_minutes <= now_minutes <= target_minutes + 5):
+        return None
 
-    logger.warning("------------------------------------------------")
-    logger.warning("")
+    date_et = et_date_str(now_utc)
+    if state.get("last_daily_summary_date_et") == date_et:
+        return None
+
+    return date_et
 
 
 def maybe_print_daily_summary_banner(
@@ -385,24 +635,8 @@ def maybe_print_daily_summary_banner(
     unrealized_plpc: Optional[float],
     market_value: Optional[float],
 ) -> bool:
-    if not DAILY_SUMMARY_BANNER:
-        return False
-
-    now_et = now_utc.astimezone(ET)
-    date_et = now_et.date().isoformat()
-
-    if state.get("last_daily_summary_date_et") == date_et:
-        return False
-
-    hhmm = parse_hhmm(DAILY_SUMMARY_ET_TIME)
-    if not hhmm:
-        return False
-    target_h, target_m = hhmm
-
-    target_minutes = target_h * 60 + target_m
-    now_minutes = now_et.hour * 60 + now_et.minute
-
-    if not (target_minutes <= now_minutes <= target_minutes + 5):
+    date_et = daily_summary_due(state, now_utc)
+    if date_et is None:
         return False
 
     state["last_daily_summary_date_et"] = date_et
@@ -436,22 +670,21 @@ def print_first_buy_banner(
     qty: int,
     sell_target: Optional[float],
 ):
+    if not logger.isEnabledFor(logging.WARNING):
+        return
+
     mode = "SIMULATION (DRY_RUN)" if DRY_RUN else ("LIVE PAPER" if not live_endpoint else "LIVE REAL MONEY")
     orders = "ENABLED" if (is_leader and not KILL_SWITCH) else "BLOCKED"
 
-    logger.warning("✅ FIRST BUY CONFIRMED (GRID GROUP START)")
-    logger.warning("----------------------------------------------")
-    logger.warning(f"MODE:      {mode}")
-    logger.warning(f"ORDERS:    {orders}")
-    logger.warning(f"SYMBOL:    {symbol}")
-    logger.warning(f"ANCHOR:    {anchor:.2f}")
-    logger.warning(f"BUY_QTY:   {qty}")
-    logger.warning(f"SELL_RISE: ${SELL_RISE_USD:.2f}")
+    parts = [_FIRST_BUY_HEAD]
+    args = [mode, orders, symbol, anchor, qty, SELL_RISE_USD]
     if sell_target is not None:
-        logger.warning(f"SELL_TGT:  {float(sell_target):.2f}")
-    logger.warning(f"LEADER:    {is_leader}")
-    logger.warning(f"KILL_SW:   {KILL_SWITCH}")
-    logger.warning("----------------------------------------------")
+        parts.append("SELL_TGT:  %.2f")
+        args.append(float(sell_target))
+    parts.append(_FIRST_BUY_TAIL)
+    args += [is_leader, KILL_SWITCH]
+
+    logger.warning("\n".join(parts), *args)
 
 
 def print_sell_arming_banner(
@@ -463,15 +696,10 @@ def print_sell_arming_banner(
     leader: bool,
     dry_run: bool,
 ):
-    logger.warning("⚠️  SELL ARMING (approaching target)")
-    logger.warning("------------------------------------------------")
-    logger.warning(f"SYMBOL:    {symbol}")
-    logger.warning(f"CLOSE:     {close_price:.2f}")
-    logger.warning(f"TARGET:    {sell_target:.2f}")
-    logger.warning(f"ARM_AT:    {arm_price:.2f}")
-    logger.warning(f"LEADER:    {leader}")
-    logger.warning(f"DRY_RUN:   {dry_run}")
-    logger.warning("------------------------------------------------")
+    if not logger.isEnabledFor(logging.WARNING):
+        return
+
+    logger.warning(_SELL_ARMING_TMPL, symbol, close_price, sell_target, arm_price, leader, dry_run)
 
 
 def print_sell_banner(
@@ -485,17 +713,20 @@ def print_sell_banner(
     leader: bool,
     dry_run: bool,
 ):
-    logger.warning("✅ SELL CONFIRMED (GRID GROUP EXIT)")
-    logger.warning("----------------------------------------------")
-    logger.warning(f"SYMBOL:      {symbol}")
-    logger.warning(f"SELL_QTY:    {sell_qty}")
-    logger.warning(f"CLOSE:       {close_price:.2f}")
-    logger.warning(f"POS_BEFORE:  {pos_qty_before:.4f}")
-    logger.warning(f"ANCHOR:      {(f'{anchor:.2f}' if anchor is not None else 'None')}")
-    logger.warning(f"SELL_TGT:    {(f'{sell_target:.2f}' if sell_target is not None else 'None')}")
-    logger.warning(f"LEADER:      {leader}")
-    logger.warning(f"DRY_RUN:     {dry_run}")
-    logger.warning("----------------------------------------------")
+    if not logger.isEnabledFor(logging.WARNING):
+        return
+
+    logger.warning(
+        _SELL_TMPL,
+        symbol,
+        sell_qty,
+        close_price,
+        pos_qty_before,
+        _fmt2(anchor),
+        _fmt2(sell_target),
+        leader,
+        dry_run,
+    )
 
 
 # =========================
@@ -504,10 +735,28 @@ def print_sell_banner(
 _NUM_RE = re.compile(r"^\s*([+-]?\d+(?:\.\d+)?)")
 
 
+def _plain_number(raw: str) -> Optional[float]:
+    """float(raw) for clean numerics; None sends the caller to the _NUM_RE fallback."""
+    try:
+        v = float(raw)
+    except ValueError:
+        return None
+    # float() also takes exponents, underscores, nan, inf and a bare leading "."
+    # (".5"); _NUM_RE never did, so those still go through it (and fail there)
+    if not math.isfinite(v) or "e" in raw or "E" in raw or "_" in raw:
+        return None
+    if raw.strip().lstrip("+-").startswith("."):
+        return None
+    return v
+
+
 def env_float(name: str, default: float) -> float:
     raw = os.getenv(name)
     if raw is None or str(raw).strip() == "":
         return float(default)
+    v = _plain_number(raw)
+    if v is not None:
+        return v
     m = _NUM_RE.match(str(raw))
     if not m:
         raise ValueError(f"Env {name} must start with a number. Got: {raw!r}")
@@ -518,6 +767,9 @@ def env_int(name: str, default: int) -> int:
     raw = os.getenv(name)
     if raw is None or str(raw).strip() == "":
         return int(default)
+    v = _plain_number(raw)
+    if v is not None:
+        return int(v)
     m = _NUM_RE.match(str(raw))
     if not m:
         raise ValueError(f"Env {name} must start with a number. Got: {raw!r}")
@@ -535,12 +787,75 @@ def env_str(name: str, default: str = "") -> str:
     return (os.getenv(name, default) or "").strip()
 
 
+def env_log_level(name: str, default: int) -> int:
+    raw = env_str(name).upper()
+    if not raw:
+        return default
+    level = logging.getLevelName(raw)
+    if not isinstance(level, int):
+        raise ValueError(f"Env {name} must be a logging level name. Got: {raw!r}")
+    return level
+
+
+def parse_hhmm(s: str) -> Optional[Tuple[int, int]]:
+    try:
+        if not s:
+            return None
+        hh, mm = s.split(":")
+        return int(hh), int(mm)
+    except Exception:
+        return None
+
+
 # =========================
 # Alpaca retry helper
 # =========================
 T = TypeVar("T")
 
 
+_TRANSIENT_RE = re.compile(
+    r"internal server error|service unavailable|bad gateway|gateway timeout"
+    r"|timed out|timeout|connection reset|temporarily unavailable"
+)
+_FATAL_RE = re.compile(r"unauthorized|forbidden|invalid api key")
+
+
+# Network-level failures are transient whatever their message says
+_TRANSIENT_EXC_TYPES = (RequestsConnectionError, RequestsTimeout, ConnectionError, TimeoutError)
+
+
+@lru_cache(maxsize=256)
+def _classify_error_msg(msg: str) -> Tuple[bool, bool]:
+    """(transient, fatal) for a lowercased error message; Alpaca repeats these verbatim."""
+    return bool(_TRANSIENT_RE.search(msg)), bool(_FATAL_RE.search(msg))
+
+
+def _classify_error(e: Exception) -> Tuple[bool, bool]:
+    """(transient, fatal): exception type and HTTP status first, message text as the fallback."""
+    if isinstance(e, _TRANSIENT_EXC_TYPES):
+        return True, False
+    # alpaca_trade_api.rest.APIError carries the HTTP status; 401/403 stay message-based
+    # because Alpaca also returns 403 for non-fatal order rejections like buying power
+    status = getattr(e, "status_code", None)
+    if isinstance(status, int) and (status == 429 or status >= 500):
+        return True, False
+    return _classify_error_msg(str(e).lower())
+
+
+# Private jitter source so retry storms don't contend on the shared module RNG.
+# Seeded from os.urandom: a pid seed is 1 in every container, so replicas would
+# draw the same "random" delays and retry in lockstep.
+_JITTER_RNG = random.Random()
+# Retry jitter factors in [0.8, 1.2); 8 bits is plenty to de-synchronize retries
+_JITTER_TABLE = tuple(0.8 + i * 0.4 / 256 for i in range(256))
+
+
+@lru_cache(maxsize=8)
+def _backoff_schedule(tries: int, base_sleep: float, max_sleep: float) -> Tuple[float, ...]:
+    """Un-jittered sleep before retry n (0-based): base * 2**n, capped at max_sleep."""
+    return tuple(min(max_sleep, base_sleep * (2 ** i)) for i in range(tries))
+
+
 def alpaca_call_with_retry(
     fn: Callable[[], T],
     *,
@@ -549,39 +864,61 @@ def alpaca_call_with_retry(
     max_sleep: float = 10.0,
     label: str = "alpaca_call",
 ) -> T:
+    backoff = _backoff_schedule(tries, base_sleep, max_sleep)
     for attempt in range(1, tries + 1):
         try:
             return fn()
         except Exception as e:
-            msg = str(e).lower()
-            transient = (
-                "internal server error" in msg
-                or "service unavailable" in msg
-                or "bad gateway" in msg
-                or "gateway timeout" in msg
-                or "timed out" in msg
-                or "timeout" in msg
-                or "connection reset" in msg
-                or "temporarily unavailable" in msg
-            )
-            fatal = ("unauthorized" in msg or "forbidden" in msg or "invalid api key" in msg)
+            transient, fatal = _classify_error(e)
 
             if fatal:
-                logger.error(f"{label}: FATAL error (not retrying): {e}")
+                _error(f"{label}: FATAL error (not retrying): {e}")
                 raise
 
             if (not transient) and attempt >= 3:
-                logger.error(f"{label}: non-transient after {attempt} attempts: {e}")
+                _error(f"{label}: non-transient after {attempt} attempts: {e}")
                 raise
 
-            sleep_s = min(max_sleep, base_sleep * (2 ** (attempt - 1)))
-            sleep_s = sleep_s * (0.8 + 0.4 * random.random())
-            logger.warning(f"{label}: error attempt {attempt}/{tries}: {e} | sleeping {sleep_s:.2f}s")
+            sleep_s = backoff[attempt - 1] * _JITTER_TABLE[_JITTER_RNG.getrandbits(8)]
+            _warn(f"{label}: error attempt {attempt}/{tries}: {e} | sleeping {sleep_s:.2f}s")
             time.sleep(sleep_s)
 
     raise RuntimeError(f"{label}: failed after {tries} attempts")
 
 
+# =========================
+# Alpaca HTTP session (TCP keepalive)
+# =========================
+def _keepalive_socket_options() -> list:
+    opts = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    # Linux names; skipped where the platform doesn't expose them
+    for name, value in (("TCP_KEEPIDLE", 30), ("TCP_KEEPINTVL", 10), ("TCP_KEEPCNT", 3)):
+        if hasattr(socket, name):
+            opts.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    return opts
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """
+    Keeps idle Alpaca connections warm between trades and detects dead peers
+    in ~60s instead of stalling the loop on a half-open socket.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = HTTPConnection.default_socket_options + _keepalive_socket_options()
+        super().init_poolmanager(*args, **kwargs)
+
+
+def tune_rest_session(rest) -> None:
+    session = getattr(rest, "_session", None)
+    if session is None:
+        logger.warning("HTTP_TUNE skipped: REST client has no _session")
+        return
+    # alpaca_trade_api already reuses one requests.Session; size its pool explicitly
+    # (clock/bars/orders may overlap) and keep retrying in alpaca_call_with_retry.
+    session.mount("https://", KeepAliveAdapter(pool_connections=4, pool_maxsize=16, max_retries=0))
+
+
 # =========================
 # Persistence helpers (disk fallback)
 # =========================
@@ -591,12 +928,12 @@ def resolve_state_path() -> str:
     state_path = env_str("STATE_PATH", os.path.join(state_dir, state_file))
 
     try:
-        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        parent = os.path.dirname(state_path)
+        os.makedirs(parent, exist_ok=True)
 
-        testfile = os.path.join(os.path.dirname(state_path), ".write_test")
-        with open(testfile, "w", encoding="utf-8") as f:
-            f.write("ok")
-        os.remove(testfile)
+        # One access(2) call; on Linux it also reports EROFS for read-only mounts
+        if not os.access(parent, os.W_OK):
+            raise OSError(f"{parent} is not writable")
 
         return state_path
     except Exception as e:
@@ -610,83 +947,276 @@ def resolve_state_path() -> str:
 # =========================
 # Env vars
 # =========================
-DRY_RUN = env_bool("DRY_RUN", True)
-ORDER_QTY = env_int("ORDER_QTY", 1)
+@dataclass(frozen=True, slots=True)
+class EngineConfig:
+    # Mode / sizing
+    dry_run: bool
+    order_qty: int
+    owned_key: str  # state key holding strategy-owned qty for this mode
+
+    # Loop timing
+    poll_sec: float
+    clock_cache_sec: float  # reuse an "open" clock this long, never past its next_close
+    fill_timeout_sec: float
+    fill_poll_sec: float
+    use_trade_stream: bool  # wait for fills on the trade_updates websocket instead of polling
+    use_bar_stream: bool  # wake on streamed minute bars; REST bar polling stays as the fallback
+
+    max_buys_per_tick: int
+    log_position_changes: bool
+
+    state_save_sec: float
+    state_wal: bool  # disk state only: append per-tick deltas to a local log; snapshot every state_save_sec
+    state_fsync: bool  # fsync the disk snapshot before rename; off trades crash durability for latency
+    state_db_async_commit: bool  # opt-in: synchronous_commit=off on the state session only
+    checkpoint_batch_n: int  # persist every N bars unless a sync event (fill/reset/rollover) forces it
+
+    # Grid / group sell parameters
+    sell_rise_usd: float
+    grid_step_start_usd: float
+    grid_tier_size: int
+    grid_step_inc_usd: float
+
+    sell_arm_banner: bool
+    sell_arm_pct: float
+
+    reset_sim_owned_on_start: bool
+
+    live_trading_confirm: str
+    kill_switch: bool
+
+    # Banners
+    banner_log_level: int  # periodic banners (heartbeat, profit tracker, daily summary); trade banners stay WARNING
+    profit_tracker_every_sec: float
+    session_snapshot_banner: bool
+    session_snapshot_every_sec: float
+    daily_summary_banner: bool
+    daily_summary_et_time: str
+    daily_summary_hhmm: Optional[Tuple[int, int]]  # pre-parsed for the per-tick gate
+
+    standby_only: bool
+
+    # Risk limits
+    max_dollars_per_buy: float
+    max_position_qty: int
+    max_buys_per_day: int
+
+    # Trade window (raw strings for logs, pre-parsed (h, m) for the per-tick check)
+    trade_start_et: str
+    trade_end_et: str
+    trade_start_hhmm: Optional[Tuple[int, int]]
+    trade_end_hhmm: Optional[Tuple[int, int]]
+
+    # Alpaca
+    state_path: str
+    alpaca_key_id: str
+    alpaca_secret_key: str
+    alpaca_base_url: str
+    symbol: str
+    alpaca_data_feed: str
+
+    # Self-test / Heartbeat mode (after-hours safe)
+    self_test: bool
+    self_test_every_sec: float
+    self_test_lookback_min: int
+    self_test_max_age_min: int
+    self_test_no_orders: bool
+    self_test_daily_lookback_days: int
+    self_test_daily_max_age_days: int
+
+    # Optional: DB/leader lock/state
+    database_url: str
+    leader_lock_key: str
+    leader_lock_id: int  # explicit advisory-lock id; 0 = derive from leader_lock_key
+    standby_poll_sec: float
+
+
+@lru_cache(maxsize=1)
+def load_config() -> EngineConfig:
+    """Parse the environment once; every module constant below is read from this."""
+    key_id = env_str("ALPACA_KEY_ID") or env_str("APCA_API_KEY_ID")
+    secret = env_str("ALPACA_SECRET_KEY") or env_str("APCA_API_SECRET_KEY")
+    if not key_id or not secret:
+        raise RuntimeError(
+            "Missing Alpaca credentials: set ALPACA_KEY_ID/ALPACA_SECRET_KEY "
+            "(or APCA_API_KEY_ID/APCA_API_SECRET_KEY)."
+        )
+
+    dry_run = env_bool("DRY_RUN", True)
+    symbol = env_str("ENGINE_SYMBOL", "TSLA").upper()
+    trade_start_et = env_str("TRADE_START_ET", "")
+    trade_end_et = env_str("TRADE_END_ET", "")
+    daily_summary_et_time = env_str("DAILY_SUMMARY_ET_TIME", "15:59")  # 3:59pm ET
+    database_url = env_str("DATABASE_URL", "")
+    state_wal = env_bool("STATE_WAL", False)
+    if state_wal and database_url:
+        # The log is a file on this host: after a failover it would replay stale deltas over newer DB state
+        raise RuntimeError("STATE_WAL is for disk state only: unset STATE_WAL or DATABASE_URL.")
+
+    return EngineConfig(
+        dry_run=dry_run,
+        order_qty=env_int("ORDER_QTY", 1),
+        owned_key="sim_owned_qty" if dry_run else "strategy_owned_qty",
+
+        poll_sec=env_float("POLL_SEC", 1.0),
+        clock_cache_sec=max(0.0, env_float("CLOCK_CACHE_SEC", 5.0)),
+        fill_timeout_sec=env_float("FILL_TIMEOUT_SEC", 20.0),
+        fill_poll_sec=env_float("FILL_POLL_SEC", 0.5),
+        # USE_WS_TRADING: Alpaca has no websocket order entry, so it means "REST submit, stream fills"
+        use_trade_stream=env_bool("USE_TRADE_STREAM", False) or env_bool("USE_WS_TRADING", False),
+        use_bar_stream=env_bool("USE_BAR_STREAM", False),
+
+        max_buys_per_tick=env_int("MAX_BUYS_PER_TICK", 1),
+        log_position_changes=env_bool("LOG_POSITION_CHANGES", True),
+
+        # With the WAL on, every tick is already durable locally, so snapshot less often by default
+        state_save_sec=env_float("STATE_SAVE_SEC", 10.0 if state_wal else 0.0),
+        state_wal=state_wal,
+        state_fsync=env_bool("STATE_FSYNC", True),
+        state_db_async_commit=env_bool("STATE_DB_ASYNC_COMMIT", False),
+        checkpoint_batch_n=max(1, env_int("CHECKPOINT_BATCH_N", 1)),
+
+        sell_rise_usd=env_float("SELL_RISE_USD", 2.0),  # $X above group anchor
+        grid_step_start_usd=env_float("GRID_STEP_START_USD", 1.0),
+        grid_tier_size=env_int("GRID_TIER_SIZE", 5),
+        grid_step_inc_usd=env_float("GRID_STEP_INC_USD", 1.0),
+
+        sell_arm_banner=env_bool("SELL_ARM_BANNER", True),
+        sell_arm_pct=env_float("SELL_ARM_PCT", 0.0005),  # still used as a fraction of target for arming banner
+
+        reset_sim_owned_on_start=env_bool("RESET_SIM_OWNED_ON_START", False),
+
+        live_trading_confirm=env_str("LIVE_TRADING_CONFIRM", ""),
+        kill_switch=env_bool("KILL_SWITCH", False),
+
+        banner_log_level=env_log_level("BANNER_LOG_LEVEL", logging.INFO),
+        profit_tracker_every_sec=env_float("PROFIT_TRACKER_EVERY_SEC", 300.0),  # 5 minutes
+        session_snapshot_banner=env_bool("SESSION_SNAPSHOT_BANNER", True),
+        session_snapshot_every_sec=env_float("SESSION_SNAPSHOT_EVERY_SEC", 300.0),  # 5 minutes
+        daily_summary_banner=env_bool("DAILY_SUMMARY_BANNER", True),
+        daily_summary_et_time=daily_summary_et_time,
+        daily_summary_hhmm=parse_hhmm(daily_summary_et_time),
+
+        standby_only=env_bool("STANDBY_ONLY", False),
+
+        max_dollars_per_buy=env_float("MAX_DOLLARS_PER_BUY", 0.0),
+        max_position_qty=env_int("MAX_POSITION_QTY", 0),
+        max_buys_per_day=env_int("MAX_BUYS_PER_DAY", 0),
+
+        trade_start_et=trade_start_et,
+        trade_end_et=trade_end_et,
+        trade_start_hhmm=parse_hhmm(trade_start_et),
+        trade_end_hhmm=parse_hhmm(trade_end_et),
+
+        state_path=resolve_state_path(),
+        alpaca_key_id=key_id,
+        alpaca_secret_key=secret,
+        alpaca_base_url=env_str("ALPACA_BASE_URL") or env_str("APCA_API_BASE_URL") or "https://paper-api.alpaca.markets",
+        symbol=symbol,
+        # IMPORTANT: support either ALPACA_DATA_FEED or APCA_DATA_FEED
+        alpaca_data_feed=(env_str("ALPACA_DATA_FEED", "") or env_str("APCA_DATA_FEED", "iex")).lower(),
+
+        self_test=env_bool("SELF_TEST", False),
+        self_test_every_sec=env_float("SELF_TEST_EVERY_SEC", 300.0),
+        self_test_lookback_min=env_int("SELF_TEST_LOOKBACK_MIN", 180),
+        self_test_max_age_min=env_int("SELF_TEST_MAX_AGE_MIN", 90),
+        self_test_no_orders=env_bool("SELF_TEST_NO_ORDERS", True),
+        self_test_daily_lookback_days=env_int("SELF_TEST_DAILY_LOOKBACK_DAYS", 30),
+        self_test_daily_max_age_days=env_int("SELF_TEST_DAILY_MAX_AGE_DAYS", 5),
+
+        database_url=database_url,
+        leader_lock_key=env_str("LEADER_LOCK_KEY", f"{symbol}_ENGINE_V1"),
+        # Parsed with int(), not env_int: a 63-bit id doesn't survive a float round-trip
+        leader_lock_id=int(env_str("LEADER_LOCK_ID", "") or 0),
+        standby_poll_sec=env_float("STANDBY_POLL_SEC", 2.0),
+    )
 
-POLL_SEC = env_float("POLL_SEC", 1.0)
 
-FILL_TIMEOUT_SEC = env_float("FILL_TIMEOUT_SEC", 20.0)
-FILL_POLL_SEC = env_float("FILL_POLL_SEC", 0.5)
+CFG = load_config()
 
-MAX_BUYS_PER_TICK = env_int("MAX_BUYS_PER_TICK", 1)
-LOG_POSITION_CHANGES = env_bool("LOG_POSITION_CHANGES", True)
+DRY_RUN = CFG.dry_run
+ORDER_QTY = CFG.order_qty
+OWNED_KEY = CFG.owned_key
 
-STATE_SAVE_SEC = env_float("STATE_SAVE_SEC", 0.0)
+POLL_SEC = CFG.poll_sec
+CLOCK_CACHE_SEC = CFG.clock_cache_sec
+
+FILL_TIMEOUT_SEC = CFG.fill_timeout_sec
+FILL_POLL_SEC = CFG.fill_poll_sec
+USE_TRADE_STREAM = CFG.use_trade_stream
+USE_BAR_STREAM = CFG.use_bar_stream
+
+MAX_BUYS_PER_TICK = CFG.max_buys_per_tick
+LOG_POSITION_CHANGES = CFG.log_position_changes
+if not LOG_POSITION_CHANGES:
+    logger.addFilter(PosnChangeFilter())
+
+STATE_SAVE_SEC = CFG.state_save_sec
+STATE_WAL = CFG.state_wal
+STATE_FSYNC = CFG.state_fsync
+STATE_DB_ASYNC_COMMIT = CFG.state_db_async_commit
+CHECKPOINT_BATCH_N = CFG.checkpoint_batch_n
 
 # NEW: Grid / group sell parameters
-SELL_RISE_USD = env_float("SELL_RISE_USD", 2.0)          # $X above group anchor
-GRID_STEP_START_USD = env_float("GRID_STEP_START_USD", 1.0)
-GRID_TIER_SIZE = env_int("GRID_TIER_SIZE", 5)
-GRID_STEP_INC_USD = env_float("GRID_STEP_INC_USD", 1.0)
+SELL_RISE_USD = CFG.sell_rise_usd
+GRID_STEP_START_USD = CFG.grid_step_start_usd
+GRID_TIER_SIZE = CFG.grid_tier_size
+GRID_STEP_INC_USD = CFG.grid_step_inc_usd
 
-SELL_ARM_BANNER = env_bool("SELL_ARM_BANNER", True)
-SELL_ARM_PCT = env_float("SELL_ARM_PCT", 0.0005)  # still used as a fraction of target for arming banner
+SELL_ARM_BANNER = CFG.sell_arm_banner
+SELL_ARM_PCT = CFG.sell_arm_pct
 
-RESET_SIM_OWNED_ON_START = env_bool("RESET_SIM_OWNED_ON_START", False)
+RESET_SIM_OWNED_ON_START = CFG.reset_sim_owned_on_start
 
-LIVE_TRADING_CONFIRM = env_str("LIVE_TRADING_CONFIRM", "")
-KILL_SWITCH = env_bool("KILL_SWITCH", False)
+LIVE_TRADING_CONFIRM = CFG.live_trading_confirm
+KILL_SWITCH = CFG.kill_switch
 
-PROFIT_TRACKER_EVERY_SEC = env_float("PROFIT_TRACKER_EVERY_SEC", 300.0)  # 5 minutes
-SESSION_SNAPSHOT_BANNER = env_bool("SESSION_SNAPSHOT_BANNER", True)
-SESSION_SNAPSHOT_EVERY_SEC = env_float("SESSION_SNAPSHOT_EVERY_SEC", 300.0)  # 5 minutes
+BANNER_LOG_LEVEL = CFG.banner_log_level
+PROFIT_TRACKER_EVERY_SEC = CFG.profit_tracker_every_sec
+SESSION_SNAPSHOT_BANNER = CFG.session_snapshot_banner
+SESSION_SNAPSHOT_EVERY_SEC = CFG.session_snapshot_every_sec
 
-DAILY_SUMMARY_BANNER = env_bool("DAILY_SUMMARY_BANNER", True)
-DAILY_SUMMARY_ET_TIME = env_str("DAILY_SUMMARY_ET_TIME", "15:59")  # 3:59pm ET
+DAILY_SUMMARY_BANNER = CFG.daily_summary_banner
+DAILY_SUMMARY_ET_TIME = CFG.daily_summary_et_time
 
-STANDBY_ONLY = env_bool("STANDBY_ONLY", False)
+STANDBY_ONLY = CFG.standby_only
 
-MAX_DOLLARS_PER_BUY = env_float("MAX_DOLLARS_PER_BUY", 0.0)
-MAX_POSITION_QTY = env_int("MAX_POSITION_QTY", 0)
-MAX_BUYS_PER_DAY = env_int("MAX_BUYS_PER_DAY", 0)
+MAX_DOLLARS_PER_BUY = CFG.max_dollars_per_buy
+MAX_POSITION_QTY = CFG.max_position_qty
+MAX_BUYS_PER_DAY = CFG.max_buys_per_day
 
-TRADE_START_ET = env_str("TRADE_START_ET", "")
-TRADE_END_ET = env_str("TRADE_END_ET", "")
+TRADE_START_ET = CFG.trade_start_et
+TRADE_END_ET = CFG.trade_end_et
 
-STATE_PATH = resolve_state_path()
-ALPACA_KEY_ID = env_str("ALPACA_KEY_ID") or env_str("APCA_API_KEY_ID")
-ALPACA_SECRET_KEY = env_str("ALPACA_SECRET_KEY") or env_str("APCA_API_SECRET_KEY")
-ALPACA_BASE_URL = env_str("ALPACA_BASE_URL") or env_str("APCA_API_BASE_URL") or "https://paper-api.alpaca.markets"
+STATE_PATH = CFG.state_path
+ALPACA_KEY_ID = CFG.alpaca_key_id
+ALPACA_SECRET_KEY = CFG.alpaca_secret_key
+ALPACA_BASE_URL = CFG.alpaca_base_url
 
-SYMBOL = env_str("ENGINE_SYMBOL", "TSLA").upper()
+SYMBOL = CFG.symbol
 
-# IMPORTANT: support either ALPACA_DATA_FEED or APCA_DATA_FEED
-ALPACA_DATA_FEED = (env_str("ALPACA_DATA_FEED", "") or env_str("APCA_DATA_FEED", "iex")).lower()
+ALPACA_DATA_FEED = CFG.alpaca_data_feed
 logger.info(f"CONFIG alpaca_data_feed={ALPACA_DATA_FEED}")
 
 # =========================
 # Self-test / Heartbeat mode (after-hours safe)
 # =========================
-SELF_TEST = env_bool("SELF_TEST", False)
-SELF_TEST_EVERY_SEC = env_float("SELF_TEST_EVERY_SEC", 300.0)
-SELF_TEST_LOOKBACK_MIN = env_int("SELF_TEST_LOOKBACK_MIN", 180)
-SELF_TEST_MAX_AGE_MIN = env_int("SELF_TEST_MAX_AGE_MIN", 90)
-SELF_TEST_NO_ORDERS = env_bool("SELF_TEST_NO_ORDERS", True)
-
-SELF_TEST_DAILY_LOOKBACK_DAYS = env_int("SELF_TEST_DAILY_LOOKBACK_DAYS", 30)
-SELF_TEST_DAILY_MAX_AGE_DAYS = env_int("SELF_TEST_DAILY_MAX_AGE_DAYS", 5)
-
-if not ALPACA_KEY_ID or not ALPACA_SECRET_KEY:
-    raise RuntimeError(
-        "Missing Alpaca credentials: set ALPACA_KEY_ID/ALPACA_SECRET_KEY "
-        "(or APCA_API_KEY_ID/APCA_API_SECRET_KEY)."
-    )
+SELF_TEST = CFG.self_test
+SELF_TEST_EVERY_SEC = CFG.self_test_every_sec
+SELF_TEST_LOOKBACK_MIN = CFG.self_test_lookback_min
+SELF_TEST_MAX_AGE_MIN = CFG.self_test_max_age_min
+SELF_TEST_NO_ORDERS = CFG.self_test_no_orders
+
+SELF_TEST_DAILY_LOOKBACK_DAYS = CFG.self_test_daily_lookback_days
+SELF_TEST_DAILY_MAX_AGE_DAYS = CFG.self_test_daily_max_age_days
 
 api = tradeapi.REST(ALPACA_KEY_ID, ALPACA_SECRET_KEY, ALPACA_BASE_URL)
+tune_rest_session(api)
 
-DATABASE_URL = env_str("DATABASE_URL", "")
-LEADER_LOCK_KEY = env_str("LEADER_LOCK_KEY", f"{SYMBOL}_ENGINE_V1")
-STANDBY_POLL_SEC = env_float("STANDBY_POLL_SEC", 2.0)
+DATABASE_URL = CFG.database_url
+DB_ENABLED = bool(DATABASE_URL)
+LEADER_LOCK_KEY = CFG.leader_lock_key
+STANDBY_POLL_SEC = CFG.standby_poll_sec
 
 
 # =========================
@@ -699,31 +1229,61 @@ def is_live_endpoint(url: str) -> bool:
     return "api.alpaca.markets" in u
 
 
-def parse_hhmm(s: str) -> Optional[Tuple[int, int]]:
-    try:
-        if not s:
-            return None
-        hh, mm = s.split(":")
-        return int(hh), int(mm)
-    except Exception:
-        return None
+# Trade window in ET minutes-of-day; None means "no window configured" (always open)
+if CFG.trade_start_hhmm and CFG.trade_end_hhmm:
+    _TRADE_START_M: Optional[int] = CFG.trade_start_hhmm[0] * 60 + CFG.trade_start_hhmm[1]
+    _TRADE_END_M: Optional[int] = CFG.trade_end_hhmm[0] * 60 + CFG.trade_end_hhmm[1]
+else:
+    _TRADE_START_M = None
+    _TRADE_END_M = None
+
+# Daily summary window start in ET minutes-of-day; None disables the banner
+_DAILY_SUMMARY_M: Optional[int] = (
+    CFG.daily_summary_hhmm[0] * 60 + CFG.daily_summary_hhmm[1] if CFG.daily_summary_hhmm else None
+)
+
+
+@lru_cache(maxsize=4)
+def _et_fields_for_minute(utc_minute: datetime) -> Tuple[str, int]:
+    # Keyed on the UTC minute, so the tz conversion runs once per minute, not per tick,
+    # and is shared by the trade window, daily summary and rollover lookups
+    now_et = utc_minute.astimezone(ET)
+    return now_et.date().isoformat(), now_et.hour * 60 + now_et.minute
+
+
+def _et_minute_of_day(utc_minute: datetime) -> int:
+    return _et_fields_for_minute(utc_minute)[1]
 
 
 def in_trade_window_et(now_utc: datetime) -> bool:
-    start = parse_hhmm(TRADE_START_ET)
-    end = parse_hhmm(TRADE_END_ET)
-    if not start or not end:
+    if _TRADE_START_M is None:
         return True
 
-    now_et = now_utc.astimezone(ET)
-    mins = now_et.hour * 60 + now_et.minute
-    start_m = start[0] * 60 + start[1]
-    end_m = end[0] * 60 + end[1]
-    return start_m <= mins <= end_m
+    mins = _et_minute_of_day(now_utc.replace(second=0, microsecond=0))
+    return _TRADE_START_M <= mins <= _TRADE_END_M
+
+
+_UNIX_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_ONE_US = timedelta(microseconds=1)
+
+
+def to_epoch_ns(t) -> int:
+    """Exact ns since epoch for a bar timestamp (pandas Timestamp or datetime; naive = UTC)."""
+    ns = getattr(t, "value", None)  # pandas Timestamp already carries it
+    if isinstance(ns, int):
+        return ns
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return ((t - _UNIX_EPOCH) // _ONE_US) * 1000
+
+
+def epoch_ns_to_iso(ns: int) -> str:
+    return (_UNIX_EPOCH + timedelta(microseconds=ns // 1000)).isoformat()
 
 
 def et_date_str(now_utc: datetime) -> str:
-    return now_utc.astimezone(ET).date().isoformat()
+    # The ET date can only roll on a minute boundary; reuse the per-minute conversion
+    return _et_fields_for_minute(now_utc.replace(second=0, microsecond=0))[0]
 
 
 # =========================
@@ -839,12 +1399,64 @@ def run_self_test(api_client, symbol: str, *, market_is_open: bool) -> bool:
 # Postgres state + leader lock
 # =========================
 def db_enabled() -> bool:
-    return bool(DATABASE_URL)
+    return DB_ENABLED
+
+
+# Server-side guards so a stalled leader can't pin the advisory lock forever:
+# keepalives reap dead clients, the timeouts reap stuck sessions/statements.
+DB_STATEMENT_TIMEOUT_MS = 15000
+DB_LOCK_STATEMENT_TIMEOUT_MS = 2000
+DB_LOCK_QUERY_TIMEOUT_SEC = 2.0
+
+# SQLSTATE for lock_timeout expiring (lock_not_available)
+PG_LOCK_NOT_AVAILABLE = "55P03"
+# Shortest standby cycle: a lock wait that fails fast must not turn into a hot loop
+STANDBY_MIN_CYCLE_SEC = 0.5
+
+
+def db_connect(*, statement_timeout_ms: int = DB_STATEMENT_TIMEOUT_MS, async_commit: bool = False):
+    options = f"-c idle_in_transaction_session_timeout=60000 -c statement_timeout={int(statement_timeout_ms)}"
+    if async_commit:
+        options += " -c synchronous_commit=off"
+    conn = psycopg2.connect(
+        DATABASE_URL,
+        connect_timeout=10,
+        keepalives=1,
+        keepalives_idle=30,
+        keepalives_interval=10,
+        keepalives_count=3,
+        options=options,
+    )
+    conn.autocommit = True
+    return conn
 
 
-def db_connect():
-    conn = psycopg2.connect(DATABASE_URL, connect_timeout=10)
-    conn.autocommit = True
+# Prepared statements live for the life of the server session, so track which
+# connections have them and keep one long-lived cursor per connection.
+_prepared_conns: "weakref.WeakSet" = weakref.WeakSet()
+_state_cursors: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def db_connect_lock():
+    """
+    Dedicated session for the leader advisory lock only. The lock is
+    session-scoped, so this connection must stay open (and referenced) for
+    the life of the process -- closing or recycling it silently drops
+    leadership. Never run state I/O on it.
+    """
+    return db_connect(statement_timeout_ms=DB_LOCK_STATEMENT_TIMEOUT_MS)
+
+
+def db_connect_state():
+    """
+    Session for engine_state reads/upserts; safe to reconnect at will.
+    STATE_DB_ASYNC_COMMIT=1 (off by default) trades durability for latency:
+    the upsert returns before Postgres flushes WAL, so a server crash can lose
+    the last fraction of a second of acknowledged state writes (never corrupt
+    them). Leave it off unless state save latency is actually a problem.
+    """
+    conn = db_connect(async_commit=STATE_DB_ASYNC_COMMIT)
+    db_init(conn)
     return conn
 
 
@@ -859,169 +1471,709 @@ def db_init(conn):
             );
             """
         )
+    db_prepare_state_statements(conn)
 
 
+def db_state_cursor(conn):
+    cur = _state_cursors.get(conn)
+    if cur is None or cur.closed:
+        cur = conn.cursor()
+        _state_cursors[conn] = cur
+    return cur
+
+
+def db_prepare_state_statements(conn) -> None:
+    if conn in _prepared_conns:
+        return
+    cur = db_state_cursor(conn)
+    cur.execute("PREPARE engine_state_load(text) AS SELECT state FROM engine_state WHERE id = $1;")
+    cur.execute(
+        """
+        PREPARE engine_state_upsert(text, jsonb) AS
+        INSERT INTO engine_state (id, state, updated_at)
+        VALUES ($1, $2, now())
+        ON CONFLICT (id)
+        DO UPDATE SET state = EXCLUDED.state, updated_at = now();
+        """
+    )
+    _prepared_conns.add(conn)
+
+
+@lru_cache(maxsize=8)
 def _lock_int64_from_key(key: str) -> int:
     h = hashlib.sha256(key.encode("utf-8")).digest()
     return int.from_bytes(h[:8], "big", signed=False) % (2**63 - 1)
 
 
-def try_acquire_leader_lock(conn, lock_key: str) -> bool:
-    lock_id = _lock_int64_from_key(lock_key)
-    with conn.cursor() as cur:
-        cur.execute("SELECT pg_try_advisory_lock(%s);", (lock_id,))
-        return bool(cur.fetchone()[0])
+# The key is fixed for the process; hash it once instead of every standby poll.
+# The SHA-256 derivation stays: every engine sharing a key must agree on the id,
+# including older deploys during a rollout. LEADER_LOCK_ID pins it explicitly.
+LEADER_LOCK_ID = CFG.leader_lock_id or _lock_int64_from_key(LEADER_LOCK_KEY)
 
 
-def load_state_db(conn, state_id: str) -> dict:
-    with conn.cursor() as cur:
-        cur.execute("SELECT state FROM engine_state WHERE id=%s;", (state_id,))
-        row = cur.fetchone()
-        return (row[0] or {}) if row else {}
+def try_acquire_leader_lock(conn, lock_id: int) -> bool:
+    # Client-side deadline: cancel the query rather than hang the poll loop on it
+    timer = threading.Timer(DB_LOCK_QUERY_TIMEOUT_SEC, conn.cancel)
+    timer.daemon = True
+    timer.start()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s);", (lock_id,))
+            return bool(cur.fetchone()[0])
+    except QueryCanceledError:
+        logger.warning(f"LEADER_LOCK query exceeded {DB_LOCK_QUERY_TIMEOUT_SEC:.1f}s; cancelled")
+        # The server may have granted the lock before the cancel landed; don't hold it unknowingly
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s);", (lock_id,))
+        except Exception:
+            pass
+        return False
+    finally:
+        timer.cancel()
 
 
-def save_state_db(conn, state_id: str, state: dict) -> None:
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            INSERT INTO engine_state (id, state, updated_at)
-            VALUES (%s, %s, now())
-            ON CONFLICT (id)
-            DO UPDATE SET state = EXCLUDED.state, updated_at = now();
-            """,
-            (state_id, Json(state)),
-        )
+def leader_lock_held(conn, lock_id: int) -> bool:
+    """
+    True if this session still holds the advisory lock. Postgres drops a dead
+    session (and its lock) after the keepalive window, and a standby then takes
+    over at once, so the leader re-checks before every bar it may trade on.
+    Any error counts as lost: better to stop than to risk two leaders.
+    """
+    timer = threading.Timer(DB_LOCK_QUERY_TIMEOUT_SEC, conn.cancel)
+    timer.daemon = True
+    timer.start()
+    try:
+        with conn.cursor() as cur:
+            # A single-bigint advisory key is split into classid (high 32) / objid (low 32)
+            cur.execute(
+                "SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory'"
+                " AND pid = pg_backend_pid() AND granted AND objsubid = 1"
+                " AND ((classid::bigint << 32) | objid::bigint) = %s);",
+                (lock_id,),
+            )
+            return bool(cur.fetchone()[0])
+    except Exception as e:
+        logger.error(f"LEADER_LOCK check failed: {e}")
+        return False
+    finally:
+        timer.cancel()
+
+
+def release_leader_lock(conn, lock_id: int) -> None:
+    """Explicit unlock + close on shutdown so a standby can take over immediately."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s);", (lock_id,))
+        logger.info("LEADER_LOCK released")
+    except Exception as e:
+        logger.warning(f"LEADER_LOCK release failed: {e}")
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def wait_acquire_leader_lock(conn, lock_id: int, wait_sec: float) -> bool:
+    """
+    Standby acquire: block server-side in pg_advisory_lock for up to wait_sec.
+    Returns True the moment the leader's session releases or dies, instead of
+    discovering it on the next poll; False when lock_timeout expires.
+    """
+    wait_ms = max(1, int(wait_sec * 1000))
+    # Client-side deadline on top of the server-side one, as in try_acquire_leader_lock
+    timer = threading.Timer(wait_sec + DB_LOCK_QUERY_TIMEOUT_SEC, conn.cancel)
+    timer.daemon = True
+    timer.start()
+    try:
+        with conn.cursor() as cur:
+            # One implicit transaction: the is_local settings only cover this lock wait
+            cur.execute(
+                "SELECT set_config('lock_timeout', %s, true), set_config('statement_timeout', %s, true);"
+                " SELECT pg_advisory_lock(%s);",
+                (f"{wait_ms}ms", f"{wait_ms + DB_LOCK_STATEMENT_TIMEOUT_MS}ms", lock_id),
+            )
+        return True
+    except QueryCanceledError:
+        logger.warning(f"LEADER_LOCK wait exceeded {wait_sec + DB_LOCK_QUERY_TIMEOUT_SEC:.1f}s; cancelled")
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s);", (lock_id,))
+        except Exception:
+            pass
+        return False
+    except psycopg2.OperationalError as e:
+        if getattr(e, "pgcode", None) == PG_LOCK_NOT_AVAILABLE:
+            return False
+        raise
+    finally:
+        timer.cancel()
+
+
+def load_state_db(conn, state_id: str) -> dict:
+    db_prepare_state_statements(conn)
+    cur = db_state_cursor(conn)
+    cur.execute("EXECUTE engine_state_load(%s);", (state_id,))
+    row = cur.fetchone()
+    return (row[0] or {}) if row else {}
+
+
+def save_state_db(conn, state_id: str, state: dict, *, body: Optional[bytes] = None) -> None:
+    # The statement's jsonb parameter casts the text server-side, so the body is
+    # serialized once here (orjson when available) instead of via psycopg2's Json.
+    buf = body if body is not None else state_dumps(state)
+    db_prepare_state_statements(conn)
+    db_state_cursor(conn).execute(
+        "EXECUTE engine_state_upsert(%s, %s);",
+        (state_id, buf.decode("utf-8")),
+    )
 
 
 # =========================
 # Disk state (fallback)
 # =========================
+def state_dumps(payload: dict) -> bytes:
+    if HAS_ORJSON:
+        return orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(payload, separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+
+def state_loads(buf: bytes) -> dict:
+    if HAS_ORJSON:
+        return orjson.loads(buf)
+    return json.loads(buf)
+
+
 def load_state_disk() -> dict:
     try:
         if os.path.exists(STATE_PATH):
-            with open(STATE_PATH, "r", encoding="utf-8") as f:
-                return json.load(f) or {}
+            with open(STATE_PATH, "rb") as f:
+                return state_loads(f.read()) or {}
     except Exception as e:
         logger.warning(f"STATE_LOAD failed: {e}")
     return {}
 
 
-def save_state_disk(payload: dict) -> None:
+def save_state_disk(payload: dict, *, body: Optional[bytes] = None) -> bool:
     try:
         os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
-        with open(STATE_PATH, "w", encoding="utf-8") as f:
-            json.dump(payload, f, indent=2, sort_keys=True)
+        buf = body if body is not None else state_dumps(payload)
+
+        # Single write to a temp file, then atomic rename: a crash never leaves a torn state file
+        tmp = STATE_PATH + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(buf)
+            if STATE_FSYNC:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, STATE_PATH)
+        return True
     except Exception as e:
         logger.warning(f"STATE_SAVE failed: {e}")
+        return False
 
 
-def maybe_persist_state(state: dict, payload: dict, *, db_conn=None, state_id: str = "") -> None:
-    state.update(payload)
-
-    if STATE_SAVE_SEC <= 0:
-        should_save = True
-        state["_last_save_ts"] = time.time()
-    else:
-        now_ts = time.time()
-        last_ts = float(state.get("_last_save_ts", 0.0))
-        should_save = (now_ts - last_ts) >= STATE_SAVE_SEC
-        if should_save:
-            state["_last_save_ts"] = now_ts
-
-    if not should_save:
-        return
+# Optional state write-ahead log (STATE_WAL=true, disk state only). Each tick's
+# changed keys are appended as one compact JSON line stamped with a sequence
+# number; the disk snapshot is only rewritten every STATE_SAVE_SEC, records the
+# last sequence it covers, and then the log is truncated. On startup only the
+# entries newer than the loaded snapshot are replayed over it.
+WAL_SEQ_KEY = "state_wal_seq"
+_wal_fd: Optional[int] = None
+_wal_lock = threading.Lock()
+_wal_seq = 0  # seq of the last append; a snapshot may only truncate entries it covers
+# Last value written to the log per key. Deltas diff against this, not `state`:
+# main() mutates state in place before handing over the payload, so a diff
+# against state would silently drop every in-place change.
+_wal_logged: dict = {}
 
-    if db_conn is not None and state_id:
-        save_state_db(db_conn, state_id, state)
-    else:
-        save_state_disk(state)
 
+def state_wal_path() -> str:
+    return STATE_PATH + ".wal"
 
-# =========================
-# Trading helpers
-# =========================
-def _is_transient_msg(msg: str) -> bool:
-    m = (msg or "").lower()
-    return (
-        "internal server error" in m
-        or "service unavailable" in m
-        or "bad gateway" in m
-        or "gateway timeout" in m
-        or "timed out" in m
-        or "timeout" in m
-        or "connection reset" in m
-        or "temporarily unavailable" in m
-    )
 
+def append_state_wal(delta: dict) -> None:
+    global _wal_fd, _wal_seq
+    with _wal_lock:
+        try:
+            seq = _wal_seq + 1
+            buf = state_dumps({"seq": seq, "delta": delta}) + b"\n"
+            if _wal_fd is None:
+                _wal_fd = os.open(state_wal_path(), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            os.write(_wal_fd, buf)
+            _wal_seq = seq
+        except Exception as e:
+            logger.warning(f"STATE_WAL append failed: {e}")
 
-def get_position(symbol: str):
-    tries = 5
-    base_sleep = 0.4
-    max_sleep = 3.0
 
-    for attempt in range(1, tries + 1):
+def truncate_state_wal(upto_seq: Optional[int] = None) -> None:
+    with _wal_lock:
+        if _wal_fd is None:
+            return
+        if upto_seq is not None and upto_seq != _wal_seq:
+            return  # newer deltas landed after this snapshot was taken; keep them
         try:
-            return api.get_position(symbol)
+            os.ftruncate(_wal_fd, 0)
         except Exception as e:
-            msg = str(e).lower()
+            logger.warning(f"STATE_WAL truncate failed: {e}")
 
-            if "position does not exist" in msg:
-                return None
 
-            if _is_transient_msg(msg) and attempt < tries:
-                sleep_s = min(max_sleep, base_sleep * (2 ** (attempt - 1)))
-                sleep_s = sleep_s * (0.8 + 0.4 * random.random())
-                logger.warning(f"get_position: transient attempt {attempt}/{tries}: {e} | sleeping {sleep_s:.2f}s")
-                time.sleep(sleep_s)
-                continue
+def replay_state_wal(state: dict) -> int:
+    """
+    Apply logged deltas newer than the snapshot in `state` and resume the
+    sequence after the newest one seen. Entries at or below the snapshot's
+    WAL_SEQ_KEY are already in it (e.g. the truncate after a save never ran).
+    """
+    global _wal_seq
+    snap_seq = state.get(WAL_SEQ_KEY)
+    if not isinstance(snap_seq, int):
+        snap_seq = 0
+    last_seq = snap_seq
+    path = state_wal_path()
+    applied = skipped = 0
+    try:
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    entry = state_loads(line)
+                except Exception:
+                    break  # torn tail from a crash mid-append
+                seq = entry.get("seq") if isinstance(entry, dict) else None
+                delta = entry.get("delta") if isinstance(entry, dict) else None
+                if not isinstance(seq, int) or not isinstance(delta, dict) or seq <= snap_seq:
+                    skipped += 1
+                    continue
+                state.update(delta)
+                state[WAL_SEQ_KEY] = seq
+                last_seq = max(last_seq, seq)
+                applied += 1
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"STATE_WAL replay failed: {e}")
+    _wal_seq = last_seq
+    if applied or skipped:
+        logger.info(f"STATE_WAL replayed {applied} entries from {path} (skipped {skipped} at or below snapshot seq {snap_seq})")
+    return applied
 
-            logger.error(f"get_position: unexpected error (NOT treating as flat): {e}", exc_info=True)
-            raise
 
-    raise RuntimeError("get_position: failed after retries")
+# Digest of the last body written per target (state_id or file path), so
+# byte-identical snapshots skip the DB round-trip / fsync entirely.
+_last_saved_digest: dict = {}
 
 
-def fetch_position_snapshot(symbol: str):
-    pos_obj = get_position(symbol)
-    if not pos_obj:
-        return {
-            "pos_obj": None,
-            "pos_qty": 0.0,
-            "avg_entry": None,
-            "unrealized_pl": None,
-            "unrealized_plpc": None,
-            "market_value": None,
-            "current_price": None,
-        }
+def persisted_view(state: dict) -> dict:
+    # Underscore keys (e.g. _last_save_mono) are in-process bookkeeping and never hit storage
+    return {k: v for k, v in state.items() if not k.startswith("_")}
 
-    def _f(attr):
-        try:
-            v = getattr(pos_obj, attr, None)
-            return float(v) if v is not None else None
-        except Exception:
-            return None
 
-    qty = _f("qty") or 0.0
-    avg_entry = _f("avg_entry_price")
-    return {
-        "pos_obj": pos_obj,
-        "pos_qty": qty,
-        "avg_entry": avg_entry,
-        "unrealized_pl": _f("unrealized_pl"),
-        "unrealized_plpc": _f("unrealized_plpc"),
-        "market_value": _f("market_value"),
-        "current_price": _f("current_price"),
-    }
+def maybe_persist_state(
+    state: dict,
+    payload: dict,
+    *,
+    db_conn=None,
+    state_id: str = "",
+    force: bool = False,
+) -> bool:
+    if STATE_WAL:
+        logged = _wal_logged
+        delta = {k: v for k, v in payload.items() if k not in logged or logged[k] != v}
+        if delta:
+            append_state_wal(delta)
+            logged.update(delta)
+    state.update(payload)
+    if STATE_WAL:
+        # The snapshot records the newest entry it covers, so replay can skip older ones
+        state[WAL_SEQ_KEY] = _wal_seq
+
+    now_mono = time.monotonic()
+    if force or STATE_SAVE_SEC <= 0:
+        should_save = True
+    else:
+        last = state.get("_last_save_mono")
+        should_save = last is None or (now_mono - last) >= STATE_SAVE_SEC
+    if should_save:
+        state["_last_save_mono"] = now_mono
+
+    if not should_save:
+        return False
+
+    persisted = persisted_view(state)
+    body = state_dumps(persisted)
+    digest = hashlib.blake2b(body, digest_size=8).digest()
+
+    target = state_id if (db_conn is not None and state_id) else STATE_PATH
+    wal_seq = persisted.get(WAL_SEQ_KEY)
+    if _last_saved_digest.get(target) == digest:
+        truncate_state_wal(wal_seq)
+        return True
+
+    start_state_flusher()
+    _save_q.put((db_conn, state_id, target, persisted, body, digest, wal_seq))
+    return True
+
+
+# Background flusher: the loop only enqueues snapshots; the DB upsert / fsync
+# happens here, off the trading tick. Bursts coalesce to the newest snapshot.
+_save_q: "queue.SimpleQueue" = queue.SimpleQueue()
+_flush_thread: Optional[threading.Thread] = None
+
+
+# Callers keep handing us the connection they opened at boot; once the flusher
+# has had to replace a dropped one, route later saves to the replacement.
+_state_conn_replacements: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _save_state_db_reconnecting(db_conn, state_id: str, persisted: dict, body: bytes) -> None:
+    conn = _state_conn_replacements.get(db_conn, db_conn)
+    try:
+        save_state_db(conn, state_id, persisted, body=body)
+        return
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        logger.warning(f"STATE_SAVE connection lost ({e}); reconnecting")
+    try:
+        conn.close()
+    except Exception:
+        pass
+    # db_connect_state() re-PREPAREs on the new session
+    new_conn = db_connect_state()
+    _state_conn_replacements[db_conn] = new_conn
+    save_state_db(new_conn, state_id, persisted, body=body)
+
+
+def _write_snapshot(item) -> None:
+    db_conn, state_id, target, persisted, body, digest, wal_seq = item
+    if _last_saved_digest.get(target) == digest:
+        return
+    try:
+        if db_conn is not None and state_id:
+            _save_state_db_reconnecting(db_conn, state_id, persisted, body)
+        elif not save_state_disk(persisted, body=body):
+            return
+    except Exception as e:
+        logger.warning(f"STATE_SAVE failed: {e}")
+        return
+    _last_saved_digest[target] = digest
+    truncate_state_wal(wal_seq)
+
+
+def _flush_loop() -> None:
+    while True:
+        item = _save_q.get()
+        stopping = item is None
+        # Keep only the newest snapshot; anything older is superseded
+        while True:
+            try:
+                nxt = _save_q.get_nowait()
+            except queue.Empty:
+                break
+            if nxt is None:
+                stopping = True
+            else:
+                item = nxt
+        if item is not None:
+            _write_snapshot(item)
+        if stopping:
+            return
+
+
+def start_state_flusher() -> None:
+    global _flush_thread
+    if _flush_thread is not None:
+        return
+    _flush_thread = threading.Thread(target=_flush_loop, name="state-flusher", daemon=True)
+    _flush_thread.start()
+    atexit.register(drain_state_flusher)
+
+
+def drain_state_flusher(timeout_sec: float = 10.0) -> None:
+    if _flush_thread is None or not _flush_thread.is_alive():
+        return
+    _save_q.put(None)
+    _flush_thread.join(timeout_sec)
+
+
+# =========================
+# Alpaca websocket streams (optional: USE_TRADE_STREAM / USE_BAR_STREAM)
+# =========================
+# trade_updates replaces the get_order poll in wait_for_fill. Terminal order
+# updates are kept in a small bounded map so a fill that lands before the
+# waiter registers is not lost.
+_TERMINAL_EVENTS = frozenset({"fill", "canceled", "rejected", "expired"})
+_ORDER_FINALS_MAX = 256
+
+_order_lock = threading.Lock()
+_order_waiters: dict = {}
+_order_finals: "OrderedDict[str, Order]" = OrderedDict()
+
+# Minute bars pushed by the data stream; the main loop is woken on arrival.
+# While bars keep arriving the loop skips the REST bar query entirely; after
+# STREAM_BAR_STALE_SEC without one (reconnect, quiet feed) it polls REST again.
+_bar_queue: "queue.Queue" = queue.Queue(maxsize=16)
+STREAM_BAR_STALE_SEC = 70.0
+_last_stream_bar_mono = 0.0
+
+_stream_thread: Optional[threading.Thread] = None
+_stream_trade_updates = False
+_stream_bars = False
+
+
+class StreamBar(NamedTuple):
+    t: datetime
+    o: float
+    c: float
+
+
+async def _on_trade_update(data) -> None:
+    event = (getattr(data, "event", "") or "").lower()
+    if event not in _TERMINAL_EVENTS:
+        return
+    raw = getattr(data, "order", None) or {}
+    order_id = raw.get("id")
+    if not order_id:
+        return
+    with _order_lock:
+        _order_finals[order_id] = Order(raw)
+        while len(_order_finals) > _ORDER_FINALS_MAX:
+            _order_finals.popitem(last=False)
+        waiter = _order_waiters.get(order_id)
+    if waiter is not None:
+        waiter.set()
+    _wake.set()
+
+
+def _stream_bar_time(bar) -> Optional[datetime]:
+    t = getattr(bar, "t", None)
+    if t is None:
+        t = getattr(bar, "timestamp", None)
+    if t is None:
+        return None
+    if isinstance(t, int):  # ns since epoch
+        return datetime.fromtimestamp(t / 1e9, tz=timezone.utc)
+    if hasattr(t, "to_pydatetime"):
+        t = t.to_pydatetime()
+    return t if t.tzinfo is not None else t.replace(tzinfo=timezone.utc)
+
+
+def _stream_bar_price(bar, name: str, short: str) -> float:
+    # Mapped Bar entities expose `open`/`close`, raw ones `o`/`c`; 0.0 is a value, not "missing"
+    v = getattr(bar, name, None)
+    if v is None:
+        v = getattr(bar, short)
+    return float(v)
+
+
+async def _on_bar(bar) -> None:
+    global _last_stream_bar_mono
+    t = _stream_bar_time(bar)
+    if t is None:
+        return
+    _last_stream_bar_mono = time.monotonic()
+    item = StreamBar(t, _stream_bar_price(bar, "open", "o"), _stream_bar_price(bar, "close", "c"))
+    try:
+        _bar_queue.put_nowait(item)
+    except queue.Full:
+        # Consumer is behind: drop the oldest, the strategy only acts on the newest close
+        try:
+            _bar_queue.get_nowait()
+        except queue.Empty:
+            pass
+        _bar_queue.put_nowait(item)
+    _wake.set()
+
+
+def _run_alpaca_stream() -> None:
+    while not _stop.is_set():
+        try:
+            stream = Stream(ALPACA_KEY_ID, ALPACA_SECRET_KEY, base_url=ALPACA_BASE_URL, data_feed=ALPACA_DATA_FEED)
+            if _stream_trade_updates:
+                stream.subscribe_trade_updates(_on_trade_update)
+            if _stream_bars:
+                stream.subscribe_bars(_on_bar, SYMBOL)
+            stream.run()
+        except Exception as e:
+            logger.warning(f"ALPACA_STREAM error: {e} | reconnecting in 5s")
+        _stop.wait(5.0)
+
+
+def start_alpaca_stream(*, trade_updates: bool, bars: bool) -> None:
+    global _stream_thread, _stream_trade_updates, _stream_bars
+    if _stream_thread is not None or not (trade_updates or bars):
+        return
+    _stream_trade_updates = trade_updates
+    _stream_bars = bars
+    _stream_thread = threading.Thread(target=_run_alpaca_stream, name="alpaca-stream", daemon=True)
+    _stream_thread.start()
+    logger.info(f"ALPACA_STREAM started trade_updates={trade_updates} bars={bars}")
+
+
+def _stream_alive() -> bool:
+    return _stream_thread is not None and _stream_thread.is_alive()
+
+
+def trade_stream_active() -> bool:
+    return _stream_trade_updates and _stream_alive()
+
+
+def bar_stream_active() -> bool:
+    return _stream_bars and _stream_alive()
+
+
+def bar_stream_fresh() -> bool:
+    """Stream is up and delivered a bar recently enough that REST bar polling is redundant."""
+    return bar_stream_active() and (time.monotonic() - _last_stream_bar_mono) < STREAM_BAR_STALE_SEC
+
+
+def stream_bar_pending() -> bool:
+    return bar_stream_active() and not _bar_queue.empty()
+
+
+def take_stream_bar() -> Optional[StreamBar]:
+    """Newest queued stream bar (older ones are superseded), or None."""
+    latest = None
+    while True:
+        try:
+            latest = _bar_queue.get_nowait()
+        except queue.Empty:
+            return latest
+
+
+def await_order_final(order_id: str, timeout_sec: float):
+    """Block until the stream reports a terminal update for order_id; None on timeout."""
+    with _order_lock:
+        final = _order_finals.pop(order_id, None)
+        if final is not None:
+            return final
+        waiter = _order_waiters.setdefault(order_id, threading.Event())
+    try:
+        waiter.wait(timeout_sec)
+        with _order_lock:
+            return _order_finals.pop(order_id, None)
+    finally:
+        with _order_lock:
+            _order_waiters.pop(order_id, None)
+
+
+# =========================
+# Trading helpers
+# =========================
+_POS_NOT_EXIST_RE = re.compile(r"position does not exist", re.I)
+
+
+def _is_position_not_found(e: Exception) -> bool:
+    # Flat is a 404 that also says "position does not exist". A bare 404 (unknown
+    # symbol, wrong route) proves nothing and must not reset the grid state.
+    status = getattr(e, "status_code", None)
+    if status is None:
+        status = getattr(getattr(e, "response", None), "status_code", None)
+    if status is not None and status != 404:
+        return False
+    return _POS_NOT_EXIST_RE.search(str(e)) is not None
+
+
+# Positions only change when we trade, so collapse repeat lookups within a tick.
+# Entries are dropped on submit and after a fill wait.
+POSITION_CACHE_TTL_SEC = max(0.25, POLL_SEC / 2)
+_position_cache: dict = {}
+# snapshot_tick prefetches positions on a worker thread; a fetch that was in
+# flight across an invalidate (bumped generation) must not repopulate the cache
+_position_cache_gen: dict = {}
+_position_cache_lock = threading.Lock()
+
+
+def invalidate_position_cache(symbol: str) -> None:
+    with _position_cache_lock:
+        _position_cache.pop(symbol, None)
+        _position_cache_gen[symbol] = _position_cache_gen.get(symbol, 0) + 1
+
+
+def get_position(symbol: str):
+    with _position_cache_lock:
+        hit = _position_cache.get(symbol)
+        gen = _position_cache_gen.get(symbol, 0)
+    if hit is not None and (time.monotonic() - hit[0]) < POSITION_CACHE_TTL_SEC:
+        return hit[1]
+    pos = _get_position_uncached(symbol)
+    with _position_cache_lock:
+        if _position_cache_gen.get(symbol, 0) == gen:
+            _position_cache[symbol] = (time.monotonic(), pos)
+    return pos
+
+
+def _get_position_uncached(symbol: str):
+    tries = 5
+    backoff = _backoff_schedule(tries, 0.4, 3.0)
+
+    for attempt in range(1, tries + 1):
+        try:
+            return api.get_position(symbol)
+        except Exception as e:
+            if _is_position_not_found(e):
+                return None
+
+            if _classify_error(e)[0] and attempt < tries:
+                sleep_s = backoff[attempt - 1] * _JITTER_TABLE[_JITTER_RNG.getrandbits(8)]
+                _warn(f"get_position: transient attempt {attempt}/{tries}: {e} | sleeping {sleep_s:.2f}s")
+                time.sleep(sleep_s)
+                continue
+
+            _error(f"get_position: unexpected error (NOT treating as flat): {e}", exc_info=True)
+            raise
+
+    raise RuntimeError("get_position: failed after retries")
+
+
+def _safe_float_attr(obj, name: str, default: Optional[float] = None) -> Optional[float]:
+    """float(obj.<name>) for Alpaca's string-typed position fields; default if missing or unparsable."""
+    v = getattr(obj, name, None)
+    if v is None:
+        return default
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return default
+
+
+def fetch_position_snapshot(symbol: str):
+    pos_obj = get_position(symbol)
+    if not pos_obj:
+        return {
+            "pos_obj": None,
+            "pos_qty": 0.0,
+            "avg_entry": None,
+            "unrealized_pl": None,
+            "unrealized_plpc": None,
+            "market_value": None,
+            "current_price": None,
+        }
+
+    return {
+        "pos_obj": pos_obj,
+        "pos_qty": _safe_float_attr(pos_obj, "qty", 0.0),
+        "avg_entry": _safe_float_attr(pos_obj, "avg_entry_price"),
+        "unrealized_pl": _safe_float_attr(pos_obj, "unrealized_pl"),
+        "unrealized_plpc": _safe_float_attr(pos_obj, "unrealized_plpc"),
+        "market_value": _safe_float_attr(pos_obj, "market_value"),
+        "current_price": _safe_float_attr(pos_obj, "current_price"),
+    }
 
 
 def confirm_flat_position(symbol: str, *, checks: int = 2, delay_sec: float = 0.25) -> bool:
+    """
+    True only if `checks` uncached position reads all see flat. Each read starts
+    delay_sec after the previous one returned, so no two land in the same
+    eventual-consistency window; a false "flat" here wipes the grid state.
+    Any error means unknown, i.e. False.
+    """
+    invalidate_position_cache(symbol)
     for i in range(checks):
         try:
-            snap = fetch_position_snapshot(symbol)
+            pos = _get_position_uncached(symbol)
         except Exception:
             return False
 
-        if float(snap["pos_qty"]) != 0.0:
+        if pos and _safe_float_attr(pos, "qty", 0.0) != 0.0:
             return False
 
         if i < checks - 1:
@@ -1030,73 +2182,311 @@ def confirm_flat_position(symbol: str, *, checks: int = 2, delay_sec: float = 0.
     return True
 
 
-def submit_market_buy(symbol: str, qty: int):
+def submit_market_buy(symbol: str, qty: int, client_order_id: Optional[str] = None):
+    invalidate_position_cache(symbol)
     return alpaca_call_with_retry(
-        lambda: api.submit_order(symbol=symbol, qty=qty, side="buy", type="market", time_in_force="day"),
+        lambda: api.submit_order(
+            symbol=symbol,
+            qty=qty,
+            side="buy",
+            type="market",
+            time_in_force="day",
+            client_order_id=client_order_id,
+        ),
         label="submit_buy",
     )
 
 
-def submit_market_sell(symbol: str, qty: int):
+def submit_market_sell(symbol: str, qty: int, client_order_id: Optional[str] = None):
+    invalidate_position_cache(symbol)
     return alpaca_call_with_retry(
-        lambda: api.submit_order(symbol=symbol, qty=qty, side="sell", type="market", time_in_force="day"),
+        lambda: api.submit_order(
+            symbol=symbol,
+            qty=qty,
+            side="sell",
+            type="market",
+            time_in_force="day",
+            client_order_id=client_order_id,
+        ),
         label="submit_sell",
     )
 
 
+def find_order_by_client_id(client_order_id: str):
+    """The order Alpaca holds under client_order_id, or None if it never arrived."""
+    # Single try: most failed submits are plain rejections (buying power, halts)
+    # whose order was never created, and retrying that 404 only adds sleeps.
+    try:
+        return api.get_order_by_client_order_id(client_order_id)
+    except Exception as e:
+        if getattr(e, "status_code", None) != 404:
+            logger.warning(f"ORDER_LOOKUP client_order_id={client_order_id} failed: {e}")
+        return None
+
+
+def submit_and_await(symbol: str, side: str, qty: int):
+    """
+    Submit a market order and block until it is final (or FILL_TIMEOUT_SEC).
+    Every retry reuses one client_order_id, so a retried submit after a lost
+    response fails as a duplicate instead of placing a second order; when the
+    submit raises, the order is looked up by that id and, if Alpaca has it,
+    tracked like a normal submit. Returns (order, final).
+    """
+    client_order_id = f"{symbol.lower()}-{side}-{uuid.uuid4().hex[:16]}"
+    submit = submit_market_buy if side == "buy" else submit_market_sell
+    try:
+        order = submit(symbol, qty, client_order_id=client_order_id)
+    except Exception as e:
+        order = find_order_by_client_id(client_order_id)
+        if order is None:
+            raise
+        logger.warning(f"ORDER_RECOVERED id={order.id} client_order_id={client_order_id} after submit error: {e}")
+    logger.info(f"ORDER_SUBMITTED id={order.id} qty={qty} side={side} client_order_id={client_order_id}")
+    final = wait_for_fill(order.id, FILL_TIMEOUT_SEC, FILL_POLL_SEC)
+    invalidate_position_cache(symbol)
+    return order, final
+
+
+FILL_POLL_FIRST_SEC = 0.025
+# A live thread does not prove a live, authorized socket: re-check over REST this often
+STREAM_ORDER_CHECK_SEC = 2.0
+
+
 def wait_for_fill(order_id: str, timeout_sec: float, poll_sec: float):
-    start = time.time()
+    if trade_stream_active():
+        deadline = time.monotonic() + timeout_sec
+        while True:
+            remaining = deadline - time.monotonic()
+            o = await_order_final(order_id, min(STREAM_ORDER_CHECK_SEC, max(remaining, 0.0)))
+            if o is not None:
+                return o
+            # Stream quiet (slow fill, or a dropped/unauthorized socket): authoritative read
+            o = alpaca_call_with_retry(lambda: api.get_order(order_id), label="get_order")
+            status = (o.status or "").lower()
+            if status in ("filled", "canceled", "rejected", "expired"):
+                return o
+            if deadline - time.monotonic() <= 0:
+                return o
+
+    # Market orders usually fill within tens of ms: start polling at 25ms and
+    # back off x1.6 per poll, so a fast fill is seen almost at once; the interval
+    # never grows past poll_sec, the configured FILL_POLL_SEC.
+    deadline = time.monotonic() + timeout_sec
+    delay = min(FILL_POLL_FIRST_SEC, poll_sec)
     while True:
         o = alpaca_call_with_retry(lambda: api.get_order(order_id), label="get_order")
         status = (o.status or "").lower()
         if status in ("filled", "canceled", "rejected", "expired"):
             return o
-        if time.time() - start >= timeout_sec:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
             return o
-        time.sleep(poll_sec)
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 1.6, poll_sec)
 
 
-def pick_latest_closed_bar(symbol: str, now_utc: datetime):
-    try:
-        end = now_utc
-        start = end - timedelta(minutes=10)
+def _bar_time_utc(b) -> datetime:
+    bt = getattr(b, "t", None)
+    if bt is None:
+        return _UNIX_EPOCH
+    return bt if bt.tzinfo is not None else bt.replace(tzinfo=timezone.utc)
 
-        def _fetch():
-            return api.get_bars(
-                symbol,
-                TimeFrame.Minute,
-                start=start.isoformat(),
-                end=end.isoformat(),
-                limit=10,
-                adjustment="raw",
-                feed=ALPACA_DATA_FEED,
-            )
 
-        bars = alpaca_call_with_retry(_fetch, label="get_bars_1m")
-        bars_list = list(bars) if bars else []
-        if not bars_list:
-            logger.warning("BARS_EMPTY (no data returned)")
-            return None
+# Raw timestamp of the bar returned last time; it was already verified closed,
+# so seeing it again as the newest bar needs no tz normalization or scan.
+_last_picked_bar_t = None
+
+
+# Only the newest closed bar is ever used, but IEX skips minutes with no trades:
+# a 5-minute window still finds the last closed bar through short quiet spells
+# instead of coming back empty and warning BARS_EMPTY every tick.
+BAR_WINDOW_MIN = 5
+
+# Bar t covers [t, t+1m) and is picked once now >= t+1m, so after processing
+# bar t the next one (t+1m) can't be closed before t+2m.
+_NEXT_BAR_CLOSED_NS = 120 * 1_000_000_000
 
-        now_floor = now_utc.replace(second=0, microsecond=0)
-        for b in reversed(bars_list):
-            bt = getattr(b, "t", None)
-            if bt is None:
-                continue
-            if bt.tzinfo is None:
-                bt = bt.replace(tzinfo=timezone.utc)
-            if bt < now_floor:
-                return b
 
+def next_bar_wait_sec(last_bar_ts_ns: Optional[int]) -> float:
+    """Seconds until the bar after last_bar_ts_ns can be closed; 0.0 once it may be."""
+    if last_bar_ts_ns is None:
+        return 0.0
+    return max(0.0, (last_bar_ts_ns + _NEXT_BAR_CLOSED_NS - time.time_ns()) / 1e9)
+
+
+def fetch_recent_bars(symbol: str, end_utc: datetime) -> list:
+    start = end_utc - timedelta(minutes=BAR_WINDOW_MIN)
+
+    def _fetch():
+        return api.get_bars(
+            symbol,
+            TimeFrame.Minute,
+            start=start.isoformat(),
+            end=end_utc.isoformat(),
+            limit=BAR_WINDOW_MIN + 1,
+            adjustment="raw",
+            feed=ALPACA_DATA_FEED,
+        )
+
+    bars = alpaca_call_with_retry(_fetch, label="get_bars_1m")
+    return list(bars) if bars else []
+
+
+def select_latest_closed_bar(bars_list: list, now_utc: datetime):
+    global _last_picked_bar_t
+    if not bars_list:
+        logger.warning("BARS_EMPTY (no data returned)")
         return None
+
+    newest = bars_list[-1]
+    if _last_picked_bar_t is not None and getattr(newest, "t", None) == _last_picked_bar_t:
+        return newest
+
+    now_floor = now_utc.replace(second=0, microsecond=0)
+    if _bar_time_utc(newest) < now_floor:
+        # Usual case: the forming minute isn't in the response, so the newest bar is closed
+        b = newest
+    else:
+        # Bars come back in ascending time order: binary-search for the last one
+        # strictly before the current minute instead of scanning from the end.
+        idx = bisect_left(bars_list, now_floor, key=_bar_time_utc)
+        if idx == 0:
+            return None
+        b = bars_list[idx - 1]
+    _last_picked_bar_t = b.t
+    return b
+
+
+def pick_latest_closed_bar(symbol: str, now_utc: datetime, bars_list: Optional[list] = None):
+    try:
+        if bars_list is None:
+            bars_list = fetch_recent_bars(symbol, now_utc)
+        return select_latest_closed_bar(bars_list, now_utc)
     except Exception as e:
-        logger.error(f"GET_BARS_FAILED {e}", exc_info=True)
+        logger.error(f"GET_BARS_FAILED {e}", exc_info=want_traceback("GET_BARS_FAILED", e))
         return None
 
 
+@dataclass
+class _ClockCache:
+    clock: object = None
+    mono: float = 0.0  # time.monotonic() of the fetch
+    edge_mono: float = 0.0  # monotonic time of the clock's next open/close flip, minus a margin
+
+
+# Local and Alpaca clocks disagree by about one RTT; expire a cached clock this
+# much before its next_close/next_open so no bar past the close is traded on it.
+CLOCK_EDGE_MARGIN_SEC = 1.0
+
+
+def _clock_edge_mono(clock, fetched_mono: float) -> float:
+    """Monotonic deadline after which `clock` may have flipped open/closed."""
+    try:
+        edge = clock.next_close if clock.is_open else clock.next_open
+        secs = (edge - clock.timestamp).total_seconds()
+    except Exception:
+        return fetched_mono  # unknown edge: never reuse this clock
+    return fetched_mono + secs - CLOCK_EDGE_MARGIN_SEC
+
+
+_clock_cache = _ClockCache()
+
+
+def get_cached_clock(max_age_sec: float) -> Tuple[object, bool]:
+    """
+    (clock, fresh_fetch); refetches once the cached clock is older than
+    max_age_sec or has reached its next_close/next_open.
+    """
+    cache = _clock_cache
+    now_mono = time.monotonic()
+    if cache.clock is not None and (now_mono - cache.mono) < max_age_sec and now_mono < cache.edge_mono:
+        return cache.clock, False
+    clock = alpaca_call_with_retry(lambda: api.get_clock(), label="get_clock")
+    cache.clock = clock
+    cache.mono = time.monotonic()
+    cache.edge_mono = _clock_edge_mono(clock, cache.mono)
+    return clock, True
+
+
+class TickSnapshot(NamedTuple):
+    clock: object
+    clock_mono: float  # when the clock was fetched from Alpaca
+    clock_edge_mono: float  # when its open/closed state may flip; never trust it past this
+    now_utc: datetime
+    bars: Optional[list]  # prefetched 1m bars; None when not prefetched or the fetch failed
+
+
+# get_clock, the bar window and the position are independent REST calls; while
+# the market is open, issue them together so a tick costs max(RTT) instead of the sum.
+_tick_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="tick")
+
+
+def snapshot_tick(
+    symbol: str,
+    *,
+    prefetch_bars: bool,
+    prefetch_position: bool = False,
+    clock_max_age_sec: float = 0.0,
+) -> TickSnapshot:
+    bars_fut = None
+    if prefetch_bars:
+        bars_fut = _tick_pool.submit(fetch_recent_bars, symbol, datetime.now(timezone.utc))
+    pos_fut = None
+    if prefetch_position:
+        # Warms the position cache for the leader's snapshot later this tick
+        pos_fut = _tick_pool.submit(get_position, symbol)
+
+    clock, fetched = get_cached_clock(clock_max_age_sec)
+    if fetched:
+        now_utc = clock.timestamp
+        if now_utc.tzinfo is None:
+            now_utc = now_utc.replace(tzinfo=timezone.utc)
+    else:
+        # A cached clock's timestamp is stale; only is_open/next_* are reused
+        now_utc = datetime.now(timezone.utc)
+
+    bars = None
+    if bars_fut is not None:
+        try:
+            bars = bars_fut.result()
+        except Exception as e:
+            logger.error(f"GET_BARS_FAILED {e}", exc_info=want_traceback("GET_BARS_FAILED", e))
+    if pos_fut is not None:
+        try:
+            pos_fut.result()
+        except Exception as e:
+            # Only a cache warm-up: the leader's own read on the new bar retries and surfaces it
+            logger.debug(f"POSITION_PREFETCH_FAILED {e}")
+    return TickSnapshot(clock, _clock_cache.mono, _clock_cache.edge_mono, now_utc, bars)
+
+
 # =========================
 # Grid state helpers
 # =========================
+# Every key main() reads from persisted state, with its value for a fresh engine
+STATE_DEFAULTS = {
+    "strategy_owned_qty": 0,
+    "sim_owned_qty": 0,
+    "buys_today_et": 0,
+    "buys_today_date_et": None,
+    "first_buy_banner_shown": False,
+    "sell_banner_shown": False,
+    "sell_arm_banner_shown": False,
+    "last_daily_summary_date_et": None,
+    "grid_ref_price": None,
+    "grid_anchor_price": None,
+    "grid_last_trigger": None,
+    "grid_step_usd": float(GRID_STEP_START_USD),
+    "grid_tier_count": 0,
+    "grid_next_trigger": None,
+    "group_buy_count": 0,
+}
+
+# Persisted by older builds; dropped on load so they stop being rewritten.
+# The banner rate limits now live in monotonic, in-process underscore keys.
+RETIRED_STATE_KEYS = ("last_profit_banner_ts", "last_session_snapshot_ts")
+
+
 def reset_grid_state(state: dict) -> None:
     # Group/ladder memory
     state["grid_ref_price"] = None          # trailing reference while waiting for first buy
@@ -1114,16 +2504,43 @@ def reset_grid_state(state: dict) -> None:
 
 
 def get_owned_qty(state: dict) -> int:
-    key = "sim_owned_qty" if DRY_RUN else "strategy_owned_qty"
     try:
-        return int(state.get(key, 0))
+        return int(state.get(OWNED_KEY, 0))
     except Exception:
         return 0
 
 
-def set_owned_qty(state: dict, new_qty: int) -> None:
-    key = "sim_owned_qty" if DRY_RUN else "strategy_owned_qty"
-    state[key] = max(0, int(new_qty))
+def set_owned_qty(state: dict, new_qty: int) -> int:
+    """Store the clamped qty and return it, so callers can rebind a local copy."""
+    qty = max(0, int(new_qty))
+    state[OWNED_KEY] = qty
+    return qty
+
+
+def _to_int_qty(v, default: int) -> int:
+    """Order qty field (Alpaca sends numeric strings) as int; default when missing or unparseable."""
+    if v is None:
+        return default
+    try:
+        return int(float(v))
+    except (TypeError, ValueError):
+        return default
+
+
+# (anchor, target) for the current group; the anchor only moves on group start/reset
+_sell_target_memo: list = [None, None]
+
+
+def group_sell_target(state: dict, pos_qty: float) -> Optional[float]:
+    # Sell target is based on FIRST BUY ANCHOR (group)
+    anchor = state.get("grid_anchor_price")
+    if anchor is None or int(pos_qty) <= 0:
+        return None
+    memo = _sell_target_memo
+    if memo[0] != anchor:
+        memo[0] = anchor
+        memo[1] = float(anchor) + SELL_RISE_USD
+    return memo[1]
 
 
 def grid_init_if_needed(state: dict, close_price: float) -> None:
@@ -1175,6 +2592,68 @@ def grid_advance_after_buy(state: dict) -> None:
     state["grid_next_trigger"] = float(state["grid_last_trigger"]) - step
 
 
+# =========================
+# Loop control (wake / shutdown)
+# =========================
+_wake = threading.Event()
+_stop = threading.Event()
+
+
+def idle(timeout_sec: float) -> None:
+    """
+    Sleep up to timeout_sec, returning early when _wake is set
+    (shutdown request, or a streaming callback with new data).
+    """
+    _wake.wait(max(0.0, float(timeout_sec)))
+    _wake.clear()
+
+
+class PollTicker:
+    """
+    Fixed-rate POLL_SEC schedule anchored to time.monotonic(): tick n is due at
+    origin + n*period, so time spent on REST calls doesn't accumulate as drift.
+    """
+
+    def __init__(self, period_sec: float):
+        self.period = max(0.001, float(period_sec))
+        self.origin = time.monotonic()
+        self.n = 0
+
+    def wait(self) -> None:
+        self.n += 1
+        now = time.monotonic()
+        target = self.origin + self.n * self.period
+        if target < now:
+            # Overran (slow tick or an idle elsewhere): resume on the next slot instead of bursting
+            self.n = int((now - self.origin) // self.period) + 1
+            target = self.origin + self.n * self.period
+        idle(target - now)
+
+
+# Closed-market idle: sleep toward next_open, but wake at least this often so
+# the 5-minute DAILY_SUMMARY window is never slept through.
+MARKET_CLOSED_IDLE_MIN_SEC = 30.0
+MARKET_CLOSED_IDLE_MAX_SEC = 240.0
+MARKET_OPEN_LEAD_SEC = 60.0
+
+
+def market_closed_idle_sec(clock, now_utc: datetime) -> float:
+    next_open = getattr(clock, "next_open", None)
+    if next_open is None:
+        return MARKET_CLOSED_IDLE_MIN_SEC
+    if hasattr(next_open, "to_pydatetime"):
+        next_open = next_open.to_pydatetime()
+    if next_open.tzinfo is None:
+        next_open = next_open.replace(tzinfo=timezone.utc)
+    secs = (next_open - now_utc).total_seconds() - MARKET_OPEN_LEAD_SEC
+    return min(MARKET_CLOSED_IDLE_MAX_SEC, max(MARKET_CLOSED_IDLE_MIN_SEC, secs))
+
+
+def request_stop(*_args) -> None:
+    _stop.set()
+    _wake.set()
+
+
 # =========================
 # Main
 # =========================
@@ -1185,18 +2664,19 @@ def main():
 
     logger.info(
         "ENGINE_CONFIG "
-        f"symbol={SYMBOL} order_qty={ORDER_QTY} poll_sec={POLL_SEC} "
+        f"symbol={SYMBOL} order_qty={ORDER_QTY} poll_sec={POLL_SEC} clock_cache_sec={CLOCK_CACHE_SEC} "
         f"fill_timeout_sec={FILL_TIMEOUT_SEC} fill_poll_sec={FILL_POLL_SEC} "
         f"max_buys_per_tick={MAX_BUYS_PER_TICK} log_position_changes={LOG_POSITION_CHANGES} "
-        f"state_path={STATE_PATH} state_save_sec={STATE_SAVE_SEC} "
+        f"state_path={STATE_PATH} state_save_sec={STATE_SAVE_SEC} state_fsync={STATE_FSYNC} "
+        f"state_db_async_commit={STATE_DB_ASYNC_COMMIT} "
         f"sell_rise_usd={SELL_RISE_USD} grid_step_start_usd={GRID_STEP_START_USD} "
         f"grid_tier_size={GRID_TIER_SIZE} grid_step_inc_usd={GRID_STEP_INC_USD} "
         f"reset_sim_owned_on_start={RESET_SIM_OWNED_ON_START} kill_switch={KILL_SWITCH} "
         f"max_dollars_per_buy={MAX_DOLLARS_PER_BUY} max_position_qty={MAX_POSITION_QTY} "
         f"max_buys_per_day={MAX_BUYS_PER_DAY} trade_start_et={TRADE_START_ET} trade_end_et={TRADE_END_ET} "
         f"dry_run={DRY_RUN} alpaca_base_url={ALPACA_BASE_URL} alpaca_is_live_endpoint={live_endpoint} "
-        f"data_feed={ALPACA_DATA_FEED} db_enabled={db_enabled()} "
-        f"leader_lock_key={LEADER_LOCK_KEY if db_enabled() else ''} "
+        f"data_feed={ALPACA_DATA_FEED} db_enabled={DB_ENABLED} "
+        f"leader_lock_key={LEADER_LOCK_KEY if DB_ENABLED else ''} leader_lock_id={LEADER_LOCK_ID if DB_ENABLED else ''} "
         f"standby_only={STANDBY_ONLY} standby_poll_sec={STANDBY_POLL_SEC} "
         f"self_test={SELF_TEST} self_test_every_sec={SELF_TEST_EVERY_SEC} self_test_no_orders={SELF_TEST_NO_ORDERS}"
     )
@@ -1205,20 +2685,24 @@ def main():
         if LIVE_TRADING_CONFIRM != "I_UNDERSTAND":
             raise RuntimeError("LIVE trading blocked: set LIVE_TRADING_CONFIRM=I_UNDERSTAND to enable live orders.")
 
-    db_conn = None
+    start_alpaca_stream(trade_updates=USE_TRADE_STREAM and not DRY_RUN, bars=USE_BAR_STREAM)
+
+    lock_conn = None
+    state_conn = None
     state_id = ""
     is_leader = True
+    lock_lost = False
 
-    if db_enabled():
-        db_conn = db_connect()
-        db_init(db_conn)
+    if DB_ENABLED:
+        lock_conn = db_connect_lock()
+        state_conn = db_connect_state()
         state_id = f"{SYMBOL}_state"
 
         if STANDBY_ONLY:
             is_leader = False
             logger.info("STANDBY_ONLY=true -> STANDBY mode (no leader lock attempt)")
         else:
-            is_leader = try_acquire_leader_lock(db_conn, LEADER_LOCK_KEY)
+            is_leader = try_acquire_leader_lock(lock_conn, LEADER_LOCK_ID)
             logger.info(
                 "LEADER_LOCK acquired -> ACTIVE mode (orders allowed)"
                 if is_leader
@@ -1230,42 +2714,28 @@ def main():
     print_startup_banner(live_endpoint=live_endpoint, is_leader=is_leader)
 
     # ---- Load state ----
-    state = load_state_db(db_conn, state_id) if db_conn is not None else load_state_disk()
+    state = load_state_db(state_conn, state_id) if state_conn is not None else load_state_disk()
+    if STATE_WAL:
+        replay_state_wal(state)
 
+    # Bar timestamps are compared as epoch-ns ints; ISO is kept for logs/humans
     last_bar_ts_iso = state.get("last_bar_ts")
-    last_bar_ts: Optional[datetime] = None
-    if last_bar_ts_iso:
-        try:
-            last_bar_ts = datetime.fromisoformat(last_bar_ts_iso)
-            if last_bar_ts.tzinfo is None:
-                last_bar_ts = last_bar_ts.replace(tzinfo=timezone.utc)
-        except Exception:
-            last_bar_ts = None
+    last_bar_ts_ns: Optional[int] = state.get("last_bar_ts_ns")
+    if not isinstance(last_bar_ts_ns, int):
+        last_bar_ts_ns = None
+        if last_bar_ts_iso:
+            try:
+                last_bar_ts_ns = to_epoch_ns(datetime.fromisoformat(last_bar_ts_iso))
+            except Exception:
+                last_bar_ts_ns = None
 
     buy_count_total = int(state.get("buy_count_total", 0))
     group_buy_count = int(state.get("group_buy_count", 0))
 
-    state.setdefault("strategy_owned_qty", 0)
-    state.setdefault("sim_owned_qty", 0)
-    state.setdefault("buys_today_et", 0)
-    state.setdefault("buys_today_date_et", None)
-
-    state.setdefault("first_buy_banner_shown", False)
-    state.setdefault("sell_banner_shown", False)
-    state.setdefault("sell_arm_banner_shown", False)
-
-    state.setdefault("last_profit_banner_ts", 0.0)
-    state.setdefault("last_daily_summary_date_et", None)
-    state.setdefault("last_session_snapshot_ts", 0.0)
-
-    # Grid defaults if missing
-    state.setdefault("grid_ref_price", None)
-    state.setdefault("grid_anchor_price", None)
-    state.setdefault("grid_last_trigger", None)
-    state.setdefault("grid_step_usd", float(GRID_STEP_START_USD))
-    state.setdefault("grid_tier_count", 0)
-    state.setdefault("grid_next_trigger", None)
-    state.setdefault("group_buy_count", 0)
+    # Fill any keys missing from an older/empty snapshot; loaded values win
+    state = {**STATE_DEFAULTS, **state}
+    for k in RETIRED_STATE_KEYS:
+        state.pop(k, None)
 
     if DRY_RUN and RESET_SIM_OWNED_ON_START:
         old_sim = int(state.get("sim_owned_qty", 0))
@@ -1273,16 +2743,21 @@ def main():
             logger.info(f"RESET_SIM_OWNED_ON_START enabled -> sim_owned_qty {old_sim} -> 0")
         state["sim_owned_qty"] = 0
 
-    logger.info(
-        "STATE_LOADED "
-        f"last_bar_ts={last_bar_ts_iso} "
-        f"grid_ref_price={state.get('grid_ref_price')} grid_anchor_price={state.get('grid_anchor_price')} "
-        f"grid_last_trigger={state.get('grid_last_trigger')} grid_step_usd={state.get('grid_step_usd')} "
-        f"grid_tier_count={state.get('grid_tier_count')} grid_next_trigger={state.get('grid_next_trigger')} "
-        f"buy_count_total={buy_count_total} group_buy_count={int(state.get('group_buy_count', 0))} "
-        f"strategy_owned_qty={int(state.get('strategy_owned_qty', 0))} sim_owned_qty={int(state.get('sim_owned_qty', 0))} "
-        f"buys_today_date_et={state.get('buys_today_date_et')} buys_today_et={int(state.get('buys_today_et', 0))}"
-    )
+    if logger.isEnabledFor(logging.INFO):
+        state_get = state.get
+        logger.info(
+            "STATE_LOADED last_bar_ts=%s grid_ref_price=%s grid_anchor_price=%s "
+            "grid_last_trigger=%s grid_step_usd=%s grid_tier_count=%s grid_next_trigger=%s "
+            "buy_count_total=%s group_buy_count=%d strategy_owned_qty=%d sim_owned_qty=%d "
+            "buys_today_date_et=%s buys_today_et=%d",
+            last_bar_ts_iso,
+            state_get("grid_ref_price"), state_get("grid_anchor_price"),
+            state_get("grid_last_trigger"), state_get("grid_step_usd"),
+            state_get("grid_tier_count"), state_get("grid_next_trigger"),
+            buy_count_total, int(state_get("group_buy_count", 0)),
+            int(state_get("strategy_owned_qty", 0)), int(state_get("sim_owned_qty", 0)),
+            state_get("buys_today_date_et"), int(state_get("buys_today_et", 0)),
+        )
 
     # ------------------------------------------------------------
     # BOOT-TIME RECONCILE (DB state -> Alpaca reality)
@@ -1306,6 +2781,7 @@ def main():
 
         payload = {
             "last_bar_ts": state.get("last_bar_ts"),
+            "last_bar_ts_ns": last_bar_ts_ns,
             "buy_count_total": 0,
             "group_buy_count": 0,
             "strategy_owned_qty": 0,
@@ -1319,13 +2795,12 @@ def main():
             "grid_step_usd": float(GRID_STEP_START_USD),
             "grid_tier_count": 0,
             "grid_next_trigger": None,
-            "last_profit_banner_ts": float(state.get("last_profit_banner_ts", 0.0)),
             "last_daily_summary_date_et": state.get("last_daily_summary_date_et"),
             "first_buy_banner_shown": bool(state.get("first_buy_banner_shown", False)),
             "sell_banner_shown": bool(state.get("sell_banner_shown", False)),
             "sell_arm_banner_shown": bool(state.get("sell_arm_banner_shown", False)),
         }
-        maybe_persist_state(state, payload, db_conn=db_conn, state_id=state_id)
+        maybe_persist_state(state, payload, db_conn=state_conn, state_id=state_id)
 
     # Position-change baseline
     last_pos_qty = None
@@ -1334,51 +2809,96 @@ def main():
             last_pos_qty = float(fetch_position_snapshot(SYMBOL)["pos_qty"])
         except Exception:
             last_pos_qty = None
-        logger.info(f"POSITION_INIT qty={(last_pos_qty or 0.0):.4f}")
+        logger.info("POSITION_INIT qty=%.4f", last_pos_qty or 0.0, extra={"posn_change": True})
 
-    while True:
-        try:
-            clock = alpaca_call_with_retry(lambda: api.get_clock(), label="get_clock")
-            market_is_open = bool(clock.is_open)
+    signal.signal(signal.SIGTERM, request_stop)
+    ticker = PollTicker(POLL_SEC)
 
-            now_utc = clock.timestamp
-            if now_utc.tzinfo is None:
-                now_utc = now_utc.replace(tzinfo=timezone.utc)
+    # Checkpoint batching: fills, group resets and day rollovers persist immediately;
+    # routine bars are written every CHECKPOINT_BATCH_N bars or STATE_SAVE_SEC.
+    bars_since_checkpoint = 0
+    last_checkpoint_mono = time.monotonic()
+    rollover_pending = False
 
-            owned_qty = get_owned_qty(state)
+    market_open_hint = False
+    market_open_seen_mono = 0.0
+    market_edge_mono = 0.0
 
-            snap = fetch_position_snapshot(SYMBOL)
-            pos_qty = float(snap["pos_qty"])
-            avg_entry = snap["avg_entry"]
-            unrealized_pl = snap["unrealized_pl"]
-            unrealized_plpc = snap["unrealized_plpc"]
-            market_value = snap["market_value"]
-            current_price = snap["current_price"]
-
-            # Sell target is based on FIRST BUY ANCHOR (group)
-            anchor = state.get("grid_anchor_price")
-            sell_target = (float(anchor) + float(SELL_RISE_USD)) if (anchor is not None and int(pos_qty) > 0) else None
+    while not _stop.is_set():
+        try:
+            can_trade_bars = not SELF_TEST and (lock_conn is None or is_leader)
+            stream_fresh = bar_stream_fresh()
+            # Don't ask REST for bars before the next one can possibly have closed
+            bar_wait_sec = 0.0 if stream_fresh else next_bar_wait_sec(last_bar_ts_ns)
+            rest_bars_due = not stream_fresh and bar_wait_sec <= 0.0
+
+            # Fast path: while the clock said "open" within CLOCK_CACHE_SEC (and before
+            # its next_close), only look for a new closed bar. Clock, leader and rollover
+            # work runs once per new bar.
+            pending_bar = None
+            now_mono = time.monotonic()
+            if (
+                market_open_hint
+                and can_trade_bars
+                and (now_mono - market_open_seen_mono) < CLOCK_CACHE_SEC
+                and now_mono < market_edge_mono
+            ):
+                pending_bar = take_stream_bar() if bar_stream_active() else None
+                if pending_bar is None and bar_wait_sec > 0.0:
+                    # Nothing can be new before the boundary: one idle instead of ~60 ticks
+                    # (a streamed bar or shutdown still wakes it early)
+                    idle(bar_wait_sec)
+                    continue
+                if pending_bar is None and rest_bars_due:
+                    pending_bar = pick_latest_closed_bar(SYMBOL, datetime.now(timezone.utc))
+                if pending_bar is None or (
+                    last_bar_ts_ns is not None and to_epoch_ns(pending_bar.t) <= last_bar_ts_ns
+                ):
+                    ticker.wait()
+                    continue
 
-            printed_daily = maybe_print_daily_summary_banner(
-                state=state,
-                now_utc=now_utc,
-                is_leader=is_leader,
-                symbol=SYMBOL,
-                pos_qty=pos_qty,
-                owned_qty=owned_qty,
-                avg_entry=avg_entry,
-                sell_rise_usd=SELL_RISE_USD,
-                sell_target=sell_target,
-                buy_count_total=buy_count_total,
-                group_buy_count=int(state.get("group_buy_count", 0)),
-                buys_today_et=int(state.get("buys_today_et", 0)),
-                unrealized_pl=unrealized_pl,
-                unrealized_plpc=unrealized_plpc,
-                market_value=market_value,
+            # Prefetch bars (and the position) alongside the clock only when last tick says they'll be used.
+            # The position is only read on a new closed bar, so skip it unless one may be here.
+            bar_may_be_new = pending_bar is not None or rest_bars_due or stream_bar_pending()
+            tick = snapshot_tick(
+                SYMBOL,
+                prefetch_bars=pending_bar is None and market_open_hint and can_trade_bars and rest_bars_due,
+                prefetch_position=market_open_hint and can_trade_bars and bar_may_be_new,
+                # Closed: always ask Alpaca, so the open is noticed on the next 30s idle
+                clock_max_age_sec=CLOCK_CACHE_SEC if market_open_hint else 0.0,
             )
-            if printed_daily:
-                payload = {"last_daily_summary_date_et": state.get("last_daily_summary_date_et")}
-                maybe_persist_state(state, payload, db_conn=db_conn, state_id=state_id)
+            clock = tick.clock
+            now_utc = tick.now_utc
+            market_is_open = bool(clock.is_open)
+            market_open_hint = market_is_open
+            market_open_seen_mono = tick.clock_mono
+            market_edge_mono = tick.clock_edge_mono
+
+            # Daily summary needs a position snapshot; only pay for the REST call when it's due
+            if daily_summary_due(state, now_utc) is not None:
+                snap = fetch_position_snapshot(SYMBOL)
+                pos_qty = float(snap["pos_qty"])
+
+                printed_daily = maybe_print_daily_summary_banner(
+                    state=state,
+                    now_utc=now_utc,
+                    is_leader=is_leader,
+                    symbol=SYMBOL,
+                    pos_qty=pos_qty,
+                    owned_qty=get_owned_qty(state),
+                    avg_entry=snap["avg_entry"],
+                    sell_rise_usd=SELL_RISE_USD,
+                    sell_target=group_sell_target(state, pos_qty),
+                    buy_count_total=buy_count_total,
+                    group_buy_count=int(state.get("group_buy_count", 0)),
+                    buys_today_et=int(state.get("buys_today_et", 0)),
+                    unrealized_pl=snap["unrealized_pl"],
+                    unrealized_plpc=snap["unrealized_plpc"],
+                    market_value=snap["market_value"],
+                )
+                if printed_daily:
+                    payload = {"last_daily_summary_date_et": state.get("last_daily_summary_date_et")}
+                    maybe_persist_state(state, payload, db_conn=state_conn, state_id=state_id)
 
             # -------------------------
             # Market closed branch
@@ -1388,11 +2908,12 @@ def main():
                     run_self_test(api, SYMBOL, market_is_open=False)
                     if SELF_TEST_NO_ORDERS:
                         logger.warning("SELF_TEST_NO_ORDERS is ON (trading disabled in self-test mode)")
-                    time.sleep(SELF_TEST_EVERY_SEC)
+                    idle(SELF_TEST_EVERY_SEC)
                     continue
 
-                logger.info("MARKET_CLOSED waiting...")
-                time.sleep(30)
+                closed_idle = market_closed_idle_sec(clock, now_utc)
+                logger.info(f"MARKET_CLOSED waiting {closed_idle:.0f}s...")
+                idle(closed_idle)
                 continue
 
             # -------------------------
@@ -1402,20 +2923,24 @@ def main():
                 run_self_test(api, SYMBOL, market_is_open=True)
                 if SELF_TEST_NO_ORDERS:
                     logger.warning("SELF_TEST_NO_ORDERS is ON (trading disabled in self-test mode)")
-                time.sleep(SELF_TEST_EVERY_SEC)
+                idle(SELF_TEST_EVERY_SEC)
                 continue
 
             # -------------------------
             # Leader lock handling
             # -------------------------
-            if db_conn is not None and not is_leader:
+            if lock_conn is not None and not is_leader:
                 if STANDBY_ONLY:
-                    time.sleep(STANDBY_POLL_SEC)
+                    idle(STANDBY_POLL_SEC)
                     continue
 
-                is_leader = try_acquire_leader_lock(db_conn, LEADER_LOCK_KEY)
+                # Waits in Postgres, not in a sleep: a released or dead leader hands over at once
+                wait_start = time.monotonic()
+                is_leader = wait_acquire_leader_lock(lock_conn, LEADER_LOCK_ID, STANDBY_POLL_SEC)
                 if not is_leader:
-                    time.sleep(STANDBY_POLL_SEC)
+                    short_by = max(STANDBY_MIN_CYCLE_SEC, STANDBY_POLL_SEC) - (time.monotonic() - wait_start)
+                    if short_by > 0:
+                        idle(short_by)
                     continue
                 logger.info("LEADER_LOCK acquired -> ACTIVE mode (orders allowed)")
 
@@ -1425,36 +2950,66 @@ def main():
                 state["buys_today_date_et"] = today_et
                 state["buys_today_et"] = 0
                 logger.info(f"DAY_ROLLOVER_ET date={today_et} buys_today_et reset to 0")
+                rollover_pending = True
 
-            # Position change logs
-            if LOG_POSITION_CHANGES:
-                if last_pos_qty is None:
-                    last_pos_qty = pos_qty
-                elif pos_qty != last_pos_qty:
-                    logger.info(f"POSITION_CHANGE qty_from={last_pos_qty:.4f} qty_to={pos_qty:.4f}")
-                    last_pos_qty = pos_qty
-
-            b = pick_latest_closed_bar(SYMBOL, now_utc)
+            b = pending_bar
+            if b is None and bar_stream_active():
+                b = take_stream_bar()
+            if b is None and rest_bars_due:
+                b = pick_latest_closed_bar(SYMBOL, now_utc, tick.bars)
             if b is None:
-                time.sleep(POLL_SEC)
+                ticker.wait()
                 continue
 
-            bar_ts = b.t
-            if bar_ts.tzinfo is None:
-                bar_ts = bar_ts.replace(tzinfo=timezone.utc)
-
-            if last_bar_ts is not None and bar_ts <= last_bar_ts:
-                time.sleep(POLL_SEC)
+            bar_ts_ns = to_epoch_ns(b.t)
+            if last_bar_ts_ns is not None and bar_ts_ns <= last_bar_ts_ns:
+                ticker.wait()
                 continue
+            bar_ts_iso = epoch_ns_to_iso(bar_ts_ns)
+
+            # A leader whose lock session died may already have been replaced: never trade then
+            if lock_conn is not None and is_leader and not leader_lock_held(lock_conn, LEADER_LOCK_ID):
+                is_leader = False
+                lock_lost = True
+                logger.error("LEADER_LOCK lost -> exiting so this instance restarts as standby")
+                request_stop()
+                break
+
+            # New closed bar: only now pay for the position snapshot (REST)
+            owned_qty = get_owned_qty(state)
+            buys_today = int(state.get("buys_today_et", 0))  # written back on every buy
+
+            snap = fetch_position_snapshot(SYMBOL)
+            pos_qty = float(snap["pos_qty"])
+            avg_entry = snap["avg_entry"]
+            unrealized_pl = snap["unrealized_pl"]
+            unrealized_plpc = snap["unrealized_plpc"]
+            market_value = snap["market_value"]
+            current_price = snap["current_price"]
+
+            sell_target = group_sell_target(state, pos_qty)
+
+            # Position change logs (dropped by PosnChangeFilter when LOG_POSITION_CHANGES=false)
+            if last_pos_qty is None:
+                last_pos_qty = pos_qty
+            elif pos_qty != last_pos_qty:
+                logger.info(
+                    "POSITION_CHANGE qty_from=%.4f qty_to=%.4f",
+                    last_pos_qty,
+                    pos_qty,
+                    extra={"posn_change": True},
+                )
+                last_pos_qty = pos_qty
 
             o = float(b.o)
             c = float(b.c)
+            checkpoint_now = rollover_pending
 
             # -----------------------------------------
             # POSITION-AWARE RE-ARM / RESET
             # -----------------------------------------
             if DRY_RUN:
-                is_flat_confirmed = (get_owned_qty(state) == 0)
+                is_flat_confirmed = (owned_qty == 0)
             else:
                 is_flat_confirmed = confirm_flat_position(SYMBOL, checks=2, delay_sec=0.25)
 
@@ -1465,6 +3020,7 @@ def main():
                     or int(state.get("strategy_owned_qty", 0)) != 0
                 ):
                     logger.warning("NO_POSITION (confirmed) -> resetting GRID group state")
+                    checkpoint_now = True
 
                 reset_grid_state(state)
                 state["strategy_owned_qty"] = 0
@@ -1475,7 +3031,7 @@ def main():
             # Profit tracker + heartbeat
             maybe_print_profit_tracker_banner(
                 state=state,
-                now_ts=time.time(),
+                now_mono=time.monotonic(),
                 symbol=SYMBOL,
                 pos_qty=pos_qty,
                 avg_entry=avg_entry,
@@ -1497,7 +3053,7 @@ def main():
 
             maybe_print_session_snapshot(
                 state=state,
-                now_ts=time.time(),
+                now_mono=time.monotonic(),
                 now_utc=now_utc,
                 symbol=SYMBOL,
                 pos_qty=pos_qty,
@@ -1507,16 +3063,21 @@ def main():
                 is_leader=is_leader,
             )
 
-            logger.info(
-                f"BAR_CLOSE {SYMBOL} t={bar_ts.isoformat()} O={o:.2f} C={c:.2f} "
-                f"anchor={state.get('grid_anchor_price')} ref={state.get('grid_ref_price')} "
-                f"step={float(state.get('grid_step_usd') or GRID_STEP_START_USD):.2f} "
-                f"tier={int(state.get('grid_tier_count', 0))}/{GRID_TIER_SIZE} "
-                f"next={state.get('grid_next_trigger')} "
-                f"sell_target={(f'{float(sell_target):.2f}' if sell_target is not None else None)} "
-                f"pos_qty={int(pos_qty)} owned_qty={owned_qty} buys_today_et={int(state.get('buys_today_et', 0))} "
-                f"is_leader={is_leader}"
-            )
+            if logger.isEnabledFor(logging.INFO):
+                # %-style args: nothing is formatted unless the record is actually emitted
+                state_get = state.get
+                logger.info(
+                    "BAR_CLOSE %s t=%s O=%.2f C=%.2f anchor=%s ref=%s step=%.2f tier=%d/%d next=%s "
+                    "sell_target=%s pos_qty=%d owned_qty=%s buys_today_et=%d is_leader=%s",
+                    SYMBOL, bar_ts_iso, o, c,
+                    state_get("grid_anchor_price"), state_get("grid_ref_price"),
+                    float(state_get("grid_step_usd") or GRID_STEP_START_USD),
+                    int(state_get("grid_tier_count", 0)), GRID_TIER_SIZE,
+                    state_get("grid_next_trigger"),
+                    (f"{sell_target:.2f}" if sell_target is not None else None),
+                    int(pos_qty), owned_qty, buys_today,
+                    is_leader,
+                )
 
             buys_this_tick = 0
 
@@ -1524,28 +3085,31 @@ def main():
             # SELL trigger (anchor + SELL_RISE_USD)
             # =========================
             if sell_target is not None and int(pos_qty) > 0:
-                arm_price = float(sell_target) * (1.0 - float(SELL_ARM_PCT))
-                if SELL_ARM_BANNER and (not state.get("sell_arm_banner_shown", False)) and float(c) >= arm_price and float(c) < float(sell_target):
-                    print_sell_arming_banner(
-                        symbol=SYMBOL,
-                        close_price=float(c),
-                        sell_target=float(sell_target),
-                        arm_price=float(arm_price),
-                        leader=bool(is_leader),
-                        dry_run=bool(DRY_RUN),
-                    )
-                    state["sell_arm_banner_shown"] = True
+                # c and sell_target are already floats; decide once, build the arm price only when needed
+                hit_target = c >= sell_target
+                if SELL_ARM_BANNER and (not hit_target) and (not state.get("sell_arm_banner_shown", False)):
+                    arm_price = sell_target * (1.0 - SELL_ARM_PCT)
+                    if c >= arm_price:
+                        print_sell_arming_banner(
+                            symbol=SYMBOL,
+                            close_price=c,
+                            sell_target=sell_target,
+                            arm_price=arm_price,
+                            leader=bool(is_leader),
+                            dry_run=bool(DRY_RUN),
+                        )
+                        state["sell_arm_banner_shown"] = True
 
-                if float(c) >= float(sell_target):
+                if hit_target:
                     sell_qty = int(pos_qty) if not DRY_RUN else min(int(pos_qty), int(owned_qty))
 
                     if not state.get("sell_banner_shown", False):
                         print_sell_banner(
                             symbol=SYMBOL,
                             sell_qty=int(sell_qty),
-                            close_price=float(c),
+                            close_price=c,
                             anchor=(float(state.get("grid_anchor_price")) if state.get("grid_anchor_price") is not None else None),
-                            sell_target=float(sell_target),
+                            sell_target=sell_target,
                             pos_qty_before=float(pos_qty),
                             leader=bool(is_leader),
                             dry_run=bool(DRY_RUN),
@@ -1554,30 +3118,25 @@ def main():
 
                     if DRY_RUN:
                         logger.info(f"SIM_SELL close={c:.2f} sell_qty={sell_qty} owned_qty={owned_qty} pos_qty={int(pos_qty)}")
-                        set_owned_qty(state, owned_qty - sell_qty)
+                        owned_qty = set_owned_qty(state, owned_qty - sell_qty)
+                        checkpoint_now = True
                     else:
-                        if db_conn is not None and not is_leader:
+                        if lock_conn is not None and not is_leader:
                             logger.warning("STANDBY_BLOCK: skipping SELL (no leader lock)")
                         else:
-                            logger.info(f"SELL_SIGNAL close={c:.2f} sell_qty={sell_qty} target={float(sell_target):.2f}")
-                            order = submit_market_sell(SYMBOL, sell_qty)
-                            logger.info(f"ORDER_SUBMITTED id={order.id} qty={sell_qty} side=sell")
-                            final = wait_for_fill(order.id, FILL_TIMEOUT_SEC, FILL_POLL_SEC)
+                            logger.info(f"SELL_SIGNAL close={c:.2f} sell_qty={sell_qty} target={sell_target:.2f}")
+                            order, final = submit_and_await(SYMBOL, "sell", sell_qty)
                             logger.info(
                                 f"ORDER_FINAL id={order.id} status={(final.status or '').lower()} "
                                 f"filled_qty={getattr(final,'filled_qty',None)} avg_fill_price={getattr(final,'filled_avg_price',None)}"
                             )
-                            filled_qty = getattr(final, "filled_qty", None)
-                            dec = sell_qty
-                            try:
-                                if filled_qty is not None:
-                                    dec = int(float(filled_qty))
-                            except Exception:
-                                pass
-                            set_owned_qty(state, owned_qty - dec)
+                            dec = _to_int_qty(getattr(final, "filled_qty", None), sell_qty)
+                            owned_qty = set_owned_qty(state, owned_qty - dec)
+                            checkpoint_now = True
 
                     logger.info("GRID_GROUP_RESET after sell")
                     reset_grid_state(state)
+                    checkpoint_now = True
 
             # =========================
             # BUY trigger (Adaptive $-drop grid)
@@ -1592,31 +3151,32 @@ def main():
                 logger.info("BUY_BLOCKED outside trade window (ET).")
                 buy_blocked = True
 
-            if (not buy_blocked) and (MAX_BUYS_PER_DAY > 0) and (int(state.get("buys_today_et", 0)) >= MAX_BUYS_PER_DAY):
+            if (not buy_blocked) and (MAX_BUYS_PER_DAY > 0) and (buys_today >= MAX_BUYS_PER_DAY):
                 logger.warning(f"BUY_BLOCKED max buys per ET day reached: {MAX_BUYS_PER_DAY}")
                 buy_blocked = True
 
             # If we are flat, maintain the trailing reference and next trigger
             if (not buy_blocked) and int(pos_qty) == 0:
-                grid_init_if_needed(state, float(c))
+                grid_init_if_needed(state, c)
 
             # Execute as many triggered buys as allowed (handles fast drops)
-            while (not buy_blocked) and (buys_this_tick < MAX_BUYS_PER_TICK) and grid_should_buy(state, float(c)):
-                # Risk checks per buy (using current close as estimate)
-                if MAX_POSITION_QTY > 0:
-                    current_pos = int(pos_qty) if not DRY_RUN else int(get_owned_qty(state))
-                    if current_pos + int(ORDER_QTY) > MAX_POSITION_QTY:
+            while (not buy_blocked) and (buys_this_tick < MAX_BUYS_PER_TICK) and grid_should_buy(state, c):
+                # Risk checks per buy (using current close as estimate); all in-memory,
+                # pos_qty is this tick's snapshot, refreshed after each fill below
+                if MAX_DOLLARS_PER_BUY > 0:
+                    est_cost = c * ORDER_QTY
+                    if est_cost > MAX_DOLLARS_PER_BUY:
                         logger.warning(
-                            f"BUY_BLOCKED would exceed MAX_POSITION_QTY={MAX_POSITION_QTY} "
-                            f"(current_pos={current_pos}, order_qty={ORDER_QTY})"
+                            f"BUY_BLOCKED est_cost=${est_cost:.2f} exceeds MAX_DOLLARS_PER_BUY=${MAX_DOLLARS_PER_BUY:.2f}"
                         )
                         break
 
-                if MAX_DOLLARS_PER_BUY > 0:
-                    est_cost = float(c) * int(ORDER_QTY)
-                    if est_cost > MAX_DOLLARS_PER_BUY:
+                if MAX_POSITION_QTY > 0:
+                    current_pos = int(pos_qty) if not DRY_RUN else owned_qty
+                    if current_pos + ORDER_QTY > MAX_POSITION_QTY:
                         logger.warning(
-                            f"BUY_BLOCKED est_cost=${est_cost:.2f} exceeds MAX_DOLLARS_PER_BUY=${MAX_DOLLARS_PER_BUY:.2f}"
+                            f"BUY_BLOCKED would exceed MAX_POSITION_QTY={MAX_POSITION_QTY} "
+                            f"(current_pos={current_pos}, order_qty={ORDER_QTY})"
                         )
                         break
 
@@ -1635,13 +3195,15 @@ def main():
                         f"close={c:.2f} trigger={trigger_px:.2f} qty={ORDER_QTY} "
                         f"step={float(state.get('grid_step_usd')):.2f} tier={int(state.get('grid_tier_count', 0))}/{GRID_TIER_SIZE}"
                     )
-                    set_owned_qty(state, get_owned_qty(state) + ORDER_QTY)
-                    state["buys_today_et"] = int(state.get("buys_today_et", 0)) + 1
+                    owned_qty = set_owned_qty(state, owned_qty + ORDER_QTY)
+                    buys_today += 1
+                    state["buys_today_et"] = buys_today
+                    checkpoint_now = True
 
                     if first_buy:
                         state["grid_anchor_price"] = trigger_px  # simulation anchor
                 else:
-                    if db_conn is not None and not is_leader:
+                    if lock_conn is not None and not is_leader:
                         logger.warning("STANDBY_BLOCK: skipping BUY (no leader lock)")
                         break
                     logger.info(
@@ -1649,24 +3211,18 @@ def main():
                         f"close={c:.2f} trigger={trigger_px:.2f} qty={ORDER_QTY} "
                         f"step={float(state.get('grid_step_usd')):.2f} tier={int(state.get('grid_tier_count', 0))}/{GRID_TIER_SIZE}"
                     )
-                    order = submit_market_buy(SYMBOL, ORDER_QTY)
-                    logger.info(f"ORDER_SUBMITTED id={order.id} qty={ORDER_QTY} side=buy")
-                    final = wait_for_fill(order.id, FILL_TIMEOUT_SEC, FILL_POLL_SEC)
+                    order, final = submit_and_await(SYMBOL, "buy", ORDER_QTY)
                     logger.info(
                         f"ORDER_FINAL id={order.id} status={(final.status or '').lower()} "
                         f"filled_qty={getattr(final,'filled_qty',None)} avg_fill_price={getattr(final,'filled_avg_price',None)}"
                     )
-                    filled_qty = getattr(final, "filled_qty", None)
                     avg_fill = getattr(final, "filled_avg_price", None)
 
-                    inc = ORDER_QTY
-                    try:
-                        if filled_qty is not None:
-                            inc = int(float(filled_qty))
-                    except Exception:
-                        pass
-                    set_owned_qty(state, get_owned_qty(state) + inc)
-                    state["buys_today_et"] = int(state.get("buys_today_et", 0)) + 1
+                    inc = _to_int_qty(getattr(final, "filled_qty", None), ORDER_QTY)
+                    owned_qty = set_owned_qty(state, owned_qty + inc)
+                    buys_today += 1
+                    state["buys_today_et"] = buys_today
+                    checkpoint_now = True
 
                     # First buy anchor should be based on actual fill price if available
                     if first_buy:
@@ -1686,7 +3242,7 @@ def main():
 
                 # refresh pos_qty estimate in loop (for MAX_POSITION_QTY logic)
                 if DRY_RUN:
-                    pos_qty = float(get_owned_qty(state))
+                    pos_qty = float(owned_qty)
                 else:
                     try:
                         pos_qty = float(fetch_position_snapshot(SYMBOL)["pos_qty"])
@@ -1708,38 +3264,58 @@ def main():
                     state["first_buy_banner_shown"] = True
 
             # Persist
-            last_bar_ts = bar_ts
-            payload = {
-                "last_bar_ts": last_bar_ts.isoformat(),
-                "buy_count_total": buy_count_total,
-                "group_buy_count": int(state.get("group_buy_count", 0)),
-                "strategy_owned_qty": int(state.get("strategy_owned_qty", 0)),
-                "sim_owned_qty": int(state.get("sim_owned_qty", 0)),
-                "buys_today_date_et": state.get("buys_today_date_et"),
-                "buys_today_et": int(state.get("buys_today_et", 0)),
-                "symbol": SYMBOL,
-                # Grid fields
-                "grid_ref_price": state.get("grid_ref_price"),
-                "grid_anchor_price": state.get("grid_anchor_price"),
-                "grid_last_trigger": state.get("grid_last_trigger"),
-                "grid_step_usd": float(state.get("grid_step_usd") or GRID_STEP_START_USD),
-                "grid_tier_count": int(state.get("grid_tier_count", 0)),
-                "grid_next_trigger": state.get("grid_next_trigger"),
-                # Banners
-                "last_profit_banner_ts": float(state.get("last_profit_banner_ts", 0.0)),
-                "last_session_snapshot_ts": float(state.get("last_session_snapshot_ts", 0.0)),
-                "last_daily_summary_date_et": state.get("last_daily_summary_date_et"),
-                "first_buy_banner_shown": bool(state.get("first_buy_banner_shown", False)),
-                "sell_banner_shown": bool(state.get("sell_banner_shown", False)),
-                "sell_arm_banner_shown": bool(state.get("sell_arm_banner_shown", False)),
-            }
-            maybe_persist_state(state, payload, db_conn=db_conn, state_id=state_id)
-
-            time.sleep(POLL_SEC)
+            last_bar_ts_ns = bar_ts_ns
+            bars_since_checkpoint += 1
+            if (
+                checkpoint_now
+                or bars_since_checkpoint >= CHECKPOINT_BATCH_N
+                or (STATE_SAVE_SEC > 0 and (time.monotonic() - last_checkpoint_mono) >= STATE_SAVE_SEC)
+            ):
+                # Built only when a checkpoint is due; tick-local values come from locals
+                state_get = state.get
+                payload = {
+                    "last_bar_ts": bar_ts_iso,
+                    "last_bar_ts_ns": bar_ts_ns,
+                    "buy_count_total": buy_count_total,
+                    "group_buy_count": int(state_get("group_buy_count", 0)),
+                    "strategy_owned_qty": int(state_get("strategy_owned_qty", 0)),
+                    "sim_owned_qty": int(state_get("sim_owned_qty", 0)),
+                    "buys_today_date_et": today_et,
+                    "buys_today_et": buys_today,
+                    "symbol": SYMBOL,
+                    # Grid fields
+                    "grid_ref_price": state_get("grid_ref_price"),
+                    "grid_anchor_price": state_get("grid_anchor_price"),
+                    "grid_last_trigger": state_get("grid_last_trigger"),
+                    "grid_step_usd": float(state_get("grid_step_usd") or GRID_STEP_START_USD),
+                    "grid_tier_count": int(state_get("grid_tier_count", 0)),
+                    "grid_next_trigger": state_get("grid_next_trigger"),
+                    # Banners
+                    "last_daily_summary_date_et": state_get("last_daily_summary_date_et"),
+                    "first_buy_banner_shown": bool(state_get("first_buy_banner_shown", False)),
+                    "sell_banner_shown": bool(state_get("sell_banner_shown", False)),
+                    "sell_arm_banner_shown": bool(state_get("sell_arm_banner_shown", False)),
+                }
+                if maybe_persist_state(state, payload, db_conn=state_conn, state_id=state_id, force=checkpoint_now):
+                    bars_since_checkpoint = 0
+                    last_checkpoint_mono = time.monotonic()
+                    rollover_pending = False
+
+            ticker.wait()
 
         except Exception as e:
-            logger.error(f"ENGINE_ERROR {e}", exc_info=True)
-            time.sleep(5)
+            logger.error(f"ENGINE_ERROR {e}", exc_info=want_traceback("ENGINE_ERROR", e))
+            idle(5)
+
+    logger.warning("ENGINE_STOP shutdown requested")
+    if lock_conn is not None:
+        if is_leader:
+            release_leader_lock(lock_conn, LEADER_LOCK_ID)
+        else:
+            lock_conn.close()
+    if lock_lost:
+        # Non-zero so a restart-on-failure supervisor brings this instance back
+        sys.exit(1)
 
 
 if __name__ == "__main__":
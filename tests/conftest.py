@@ -0,0 +1,38 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# engine_readonly reads its whole config at import: give it a throwaway, disk-state setup
+os.environ.setdefault("ALPACA_KEY_ID", "test-key")
+os.environ.setdefault("ALPACA_SECRET_KEY", "test-secret")
+os.environ["STATE_DIR"] = tempfile.mkdtemp(prefix="engine-tests-")
+os.environ["DRY_RUN"] = "true"
+for name in ("DATABASE_URL", "STATE_WAL", "STATE_PATH", "STATE_FILE"):
+    os.environ.pop(name, None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import engine_readonly  # noqa: E402
+
+
+@pytest.fixture
+def engine():
+    return engine_readonly
+
+
+@pytest.fixture
+def state_files(engine, tmp_path, monkeypatch):
+    """Point disk state and the WAL at tmp_path and reset the persistence bookkeeping."""
+    monkeypatch.setattr(engine, "STATE_PATH", str(tmp_path / "engine_state.json"))
+    monkeypatch.setattr(engine, "_last_saved_digest", {})
+    monkeypatch.setattr(engine, "_wal_logged", {})
+    monkeypatch.setattr(engine, "_wal_seq", 0)
+    monkeypatch.setattr(engine, "_wal_fd", None)
+    # Snapshots are written inline by the tests instead of on the flusher thread
+    monkeypatch.setattr(engine, "start_state_flusher", lambda: None)
+    monkeypatch.setattr(engine, "_save_q", engine.queue.SimpleQueue())
+    yield tmp_path
+    if engine._wal_fd is not None:
+        os.close(engine._wal_fd)
@@ -0,0 +1,132 @@
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+
+class HTTPError(Exception):
+    """Stands in for alpaca_trade_api.rest.APIError: a message plus status_code."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# ---- error classification ----
+@pytest.mark.parametrize(
+    "exc, expected",
+    [
+        (ConnectionError("boom"), (True, False)),
+        (TimeoutError("slow"), (True, False)),
+        (HTTPError("too many requests", 429), (True, False)),
+        (HTTPError("oops", 503), (True, False)),
+        (HTTPError("insufficient buying power", 403), (False, False)),
+        (HTTPError("forbidden", 403), (False, True)),
+        (Exception("Gateway Timeout"), (True, False)),
+        (Exception("invalid api key"), (False, True)),
+        (Exception("qty must be > 0"), (False, False)),
+    ],
+)
+def test_classify_error(engine, exc, expected):
+    assert engine._classify_error(exc) == expected
+
+
+@pytest.mark.parametrize(
+    "exc, flat",
+    [
+        (HTTPError("position does not exist", 404), True),
+        (Exception("position does not exist"), True),
+        (HTTPError("asset not found", 404), False),
+        (HTTPError("position does not exist", 500), False),
+        (Exception("connection reset"), False),
+    ],
+)
+def test_is_position_not_found(engine, exc, flat):
+    assert engine._is_position_not_found(exc) is flat
+
+
+# ---- env parsing ----
+@pytest.mark.parametrize(
+    "raw, expected",
+    [("1", 1.0), (" 2.5 ", 2.5), ("-3", -3.0), ("+4.25", 4.25), ("5.", 5.0)],
+)
+def test_plain_number_fast_path(engine, raw, expected):
+    assert engine._plain_number(raw) == expected
+
+
+@pytest.mark.parametrize("raw", [".5", "-.5", "1e3", "1_000", "nan", "inf", "10s", "abc"])
+def test_plain_number_defers_to_regex(engine, raw):
+    assert engine._plain_number(raw) is None
+
+
+@pytest.mark.parametrize(
+    "raw, expected",
+    [("1.5", 1.5), ("10s", 10.0), ("0.75 # comment", 0.75), ("1e3", 1.0), ("1_000", 1.0)],
+)
+def test_env_float(engine, monkeypatch, raw, expected):
+    monkeypatch.setenv("ENGINE_TEST_NUM", raw)
+    assert engine.env_float("ENGINE_TEST_NUM", 9.0) == expected
+
+
+@pytest.mark.parametrize("raw", [".5", "-.5", "nan", "abc"])
+def test_env_float_rejects(engine, monkeypatch, raw):
+    monkeypatch.setenv("ENGINE_TEST_NUM", raw)
+    with pytest.raises(ValueError):
+        engine.env_float("ENGINE_TEST_NUM", 9.0)
+
+
+def test_env_float_default_when_unset_or_blank(engine, monkeypatch):
+    monkeypatch.delenv("ENGINE_TEST_NUM", raising=False)
+    assert engine.env_float("ENGINE_TEST_NUM", 9.0) == 9.0
+    monkeypatch.setenv("ENGINE_TEST_NUM", "  ")
+    assert engine.env_float("ENGINE_TEST_NUM", 9.0) == 9.0
+
+
+def test_env_int_truncates(engine, monkeypatch):
+    monkeypatch.setenv("ENGINE_TEST_NUM", "3.9")
+    assert engine.env_int("ENGINE_TEST_NUM", 1) == 3
+
+
+# ---- bars ----
+NOW = datetime(2026, 3, 2, 15, 30, 20, tzinfo=timezone.utc)
+
+
+def _bar(minute_offset):
+    return SimpleNamespace(t=NOW.replace(second=0) + timedelta(minutes=minute_offset))
+
+
+@pytest.fixture
+def fresh_bar_pick(engine, monkeypatch):
+    monkeypatch.setattr(engine, "_last_picked_bar_t", None)
+
+
+def test_select_latest_closed_bar_empty(engine, fresh_bar_pick):
+    assert engine.select_latest_closed_bar([], NOW) is None
+
+
+def test_select_latest_closed_bar_newest_closed(engine, fresh_bar_pick):
+    bars = [_bar(-3), _bar(-2), _bar(-1)]
+    assert engine.select_latest_closed_bar(bars, NOW) is bars[-1]
+
+
+def test_select_latest_closed_bar_skips_forming_minute(engine, fresh_bar_pick):
+    bars = [_bar(-2), _bar(-1), _bar(0)]
+    assert engine.select_latest_closed_bar(bars, NOW) is bars[1]
+
+
+def test_select_latest_closed_bar_only_forming_minute(engine, fresh_bar_pick):
+    assert engine.select_latest_closed_bar([_bar(0)], NOW) is None
+
+
+def test_select_latest_closed_bar_naive_timestamps(engine, fresh_bar_pick):
+    bars = [SimpleNamespace(t=b.t.replace(tzinfo=None)) for b in (_bar(-1), _bar(0))]
+    assert engine.select_latest_closed_bar(bars, NOW) is bars[0]
+
+
+def test_next_bar_wait_sec(engine):
+    assert engine.next_bar_wait_sec(None) == 0.0
+    now_ns = time.time_ns()
+    # Bar t closes at t+1m, so the next one can't be closed before t+2m
+    assert 85.0 < engine.next_bar_wait_sec(now_ns - 30 * 1_000_000_000) <= 90.0
+    assert engine.next_bar_wait_sec(now_ns - 180 * 1_000_000_000) == 0.0
@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import pytest
+
+
+class HTTPError(Exception):
+    """Stands in for alpaca_trade_api.rest.APIError: a message plus status_code."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@pytest.fixture
+def positions(engine, monkeypatch):
+    """Feed api.get_position from a list of results; exceptions are raised."""
+    calls = []
+
+    def install(*results):
+        queue = list(results)
+
+        def get_position(symbol):
+            calls.append(symbol)
+            result = queue.pop(0) if len(queue) > 1 else queue[0]
+            if isinstance(result, BaseException):
+                raise result
+            return result
+
+        monkeypatch.setattr(engine, "api", SimpleNamespace(get_position=get_position))
+        return calls
+
+    monkeypatch.setattr(engine.time, "sleep", lambda _s: None)
+    return install
+
+
+def test_confirm_flat_position_flat(engine, positions):
+    calls = positions(HTTPError("position does not exist", 404))
+    assert engine.confirm_flat_position("TSLA", checks=3, delay_sec=0) is True
+    assert calls == ["TSLA"] * 3
+
+
+def test_confirm_flat_position_zero_qty_counts_as_flat(engine, positions):
+    calls = positions(SimpleNamespace(qty="0"))
+    assert engine.confirm_flat_position("TSLA", delay_sec=0) is True
+    assert len(calls) == 2
+
+
+def test_confirm_flat_position_open_position(engine, positions):
+    calls = positions(SimpleNamespace(qty="5"))
+    assert engine.confirm_flat_position("TSLA", checks=3, delay_sec=0) is False
+    assert len(calls) == 1
+
+
+def test_confirm_flat_position_late_fill(engine, positions):
+    # Flat on the first read, filled by the second: not flat
+    calls = positions(HTTPError("position does not exist", 404), SimpleNamespace(qty="1"))
+    assert engine.confirm_flat_position("TSLA", delay_sec=0) is False
+    assert len(calls) == 2
+
+
+def test_confirm_flat_position_unexpected_error(engine, positions):
+    positions(ValueError("bad payload"))
+    assert engine.confirm_flat_position("TSLA", delay_sec=0) is False
+
+
+def test_confirm_flat_position_bare_404(engine, positions):
+    # A 404 without the position message (wrong symbol, bad route) is unknown, not flat
+    positions(HTTPError("asset not found", 404))
+    assert engine.confirm_flat_position("TSLA", delay_sec=0) is False